@@ -27,8 +27,7 @@ for feature, ending in directsubstitutions:
 
 # Simple Substitutions from CSV file
 csv = '/Users/yanone/Desktop/substitutions.csv'
-for feature, source, target, script, language, lookupflag, comment in SubstitutionsFromCSV(csv):
-	shoes.AddSubstitution(feature, source, target, script, language, lookupflag, comment)
+shoes.AddSubstitutions(SubstitutionsFromCSV(csv))
 
 # Fraction feature
 if shoes.HasGroups(['.numr', '.dnom']) and shoes.HasGlyphs(['fraction']):
@@ -0,0 +1,14 @@
+#!/usr/bin/python
+
+"""
+Dancing Shoes benchmarks
+
+Times the construction and emission phases of DancingShoes on synthetic fonts of different sizes
+and writes the results as JSON, so that versions can be compared and releases gated on regressions.
+
+Usage (from the repository root):
+	python -m benchmarks.run --scenarios small,medium --output results.json
+	python -m benchmarks.run --compare baseline.json
+"""
+
+__all__ = ['fonts', 'run']
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+"""
+Synthetic fonts
+
+Deterministic, font-scale input data for the benchmarks: glyph names with suffix groups,
+substitutions, classes and kerning pairs spread over several scripts, languages and lookupflags.
+"""
+
+from random import Random
+from collections import OrderedDict
+
+
+# name: (number of glyphs, number of kerning pairs)
+SCENARIOS = OrderedDict([
+	('small', (500, 1000)),
+	('medium', (5000, 100000)),
+	('large', (50000, 1000000)),
+	])
+
+FEATURES = ['smcp', 'ss01', 'kern']
+SUFFIXES = ['', '.sc', '.ss01', '.sc.ss01', '.tosf', '.alt']
+CONTEXTS = [('latn', ''), ('latn', 'DEU'), ('latn', 'TRK'), ('cyrl', ''), ('cyrl', 'SRB'), ('grek', '')] # (script, language)
+LOOKUPFLAGS = ['', 'IgnoreMarks', 'IgnoreLigatures', 'RightToLeft,IgnoreMarks']
+
+
+class SyntheticFont:
+	'''
+	Input data of one synthetic font. Same name, size and seed always give the same data.
+	'''
+	def __init__(self, name, glyphcount, paircount, seed = 0):
+		self.name = name
+		self.glyphcount = glyphcount
+		self.paircount = paircount
+		self.features = FEATURES
+		random = Random(seed)
+
+		# Glyph names: every base glyph with each suffix in turn, so all suffix groups are populated
+		self.glyphnames = []
+		for i in range(glyphcount):
+			self.glyphnames.append('g%05d%s' % (i // len(SUFFIXES), SUFFIXES[i % len(SUFFIXES)]))
+		basenames = [glyph for glyph in self.glyphnames if not '.' in glyph]
+
+		# Sequences to check for presence, a fifth of them with a missing glyph
+		self.glyphlists = []
+		for i in range(max(1000, glyphcount)):
+			glyphs = random.sample(self.glyphnames, 3)
+			if i % 5 == 0:
+				glyphs.append('missing%s' % (i))
+			self.glyphlists.append(glyphs)
+
+		# Substitutions (feature, source, target, script, language, lookupflag, comment), some with missing targets
+		self.substitutions = []
+		for base in basenames:
+			self.substitutions.append(('smcp', base, base + '.sc', '', '', '', ''))
+			self.substitutions.append(('ss01', base, base + '.ss01', '', '', '', ''))
+			script, language = random.choice(CONTEXTS)
+			self.substitutions.append(('ss01', base + '.sc', base + '.sc.ss01', script, language, random.choice(LOOKUPFLAGS), 'context'))
+			self.substitutions.append(('smcp', base + '.alt', base + '.alt.sc', '', '', '', ''))
+
+		# Classes and class strings to deflate
+		self.classes = OrderedDict()
+		for i in range(max(10, glyphcount // 100)):
+			self.classes['@class%s' % (i)] = random.sample(self.glyphnames, min(50, glyphcount))
+		classnames = list(self.classes.keys())
+		self.classstrings = []
+		for i in range(max(1000, glyphcount)):
+			self.classstrings.append("[%s %s] %s' %s" % (random.choice(classnames), random.choice(self.glyphnames), random.choice(classnames), random.choice(self.glyphnames)))
+
+		# Kerning pairs (pair, adjustment, script, language, lookupflag), most of them in the default script
+		self.pairs = []
+		for i in range(paircount):
+			pair = '%s %s' % (random.choice(self.glyphnames), random.choice(self.glyphnames))
+			if i % 4 == 0:
+				script, language = random.choice(CONTEXTS)
+				lookupflag = random.choice(LOOKUPFLAGS)
+			else:
+				script, language, lookupflag = '', '', ''
+			self.pairs.append((pair, random.randint(-120, 60), script, language, lookupflag))
+
+
+def Scenario(name, seed = 0):
+	'''
+	Returns SyntheticFont of a named scenario from SCENARIOS.
+	'''
+	glyphcount, paircount = SCENARIOS[name]
+	return SyntheticFont(name, glyphcount, paircount, seed)
@@ -0,0 +1,336 @@
+#!/usr/bin/python
+
+"""
+Benchmark runner
+
+Builds each scenario of benchmarks.fonts and times the phases below. For every phase, the fastest
+of the repeated runs is reported together with its memory (the largest of the repeated runs, as later
+runs reuse memory freed by earlier ones):
+
+- rssgrowthbytes: growth of the resident set size of the process from the start to the end of the phase.
+  Memory that is freed again before the phase ends is not included.
+- peakbytes: with --memory, the peak memory use during the phase over the memory in use at its start.
+  Measured with tracemalloc where available (Python 3.4 and later), otherwise from the peak resident set size
+  (VmHWM), which is reset before each phase (Linux 4.0 and later). --memory fails where neither is available.
+
+After the phases, the memory footprint per lookup record is measured for every lookup type.
+
+Results are written as JSON. With --compare, phases that got slower than a baseline result file by more
+than the tolerance are listed and the exit status is 1, for gating releases.
+"""
+
+import sys, time, json, platform, optparse
+from collections import OrderedDict
+
+import dancingshoes
+from dancingshoes import DancingShoes, CollectGlyphGroups, ResidentBytes
+from benchmarks.fonts import SCENARIOS, Scenario
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+
+## Phases, each called with (font, shoes) and returning the number of operations
+
+def PhaseCollectGlyphGroups(font, shoes):
+	CollectGlyphGroups(font.glyphnames)
+	return len(font.glyphnames)
+
+def PhaseHasGlyphs(font, shoes):
+	for glyphs in font.glyphlists:
+		shoes.HasGlyphs(glyphs)
+	return len(font.glyphlists)
+
+def PhaseAddSubstitution(font, shoes):
+	for feature, source, target, script, language, lookupflag, comment in font.substitutions:
+		shoes.AddSubstitution(feature, source, target, script, language, lookupflag, comment)
+	return len(font.substitutions)
+
+def PhaseAddGlyphsToClass(font, shoes):
+	for classname, glyphs in font.classes.items():
+		shoes.AddGlyphsToClass(classname, glyphs)
+	return len(font.classes)
+
+def PhaseDeflateClassString(font, shoes):
+	for string in font.classstrings:
+		shoes.DeflateClassString(string)
+	return len(font.classstrings)
+
+def PhaseAddPairPositioning(font, shoes):
+	for pair, adjustment, script, language, lookupflag in font.pairs:
+		shoes.AddPairPositioning('kern', pair, adjustment, script, language, lookupflag)
+	return len(font.pairs)
+
+def PhaseGetFDKFeatureContent(font, shoes):
+	features = shoes.UsedFeatures()
+	for feature in features:
+		shoes.GetFDKFeatureContent(feature, '2.5')
+	return len(features)
+
+def PhaseGetFDKCode(font, shoes):
+	shoes.GetFDKCode('2.5')
+	return 1
+
+PHASES = [
+	('CollectGlyphGroups', PhaseCollectGlyphGroups),
+	('DancingShoes', None), # construction, see RunScenario()
+	('HasGlyphs', PhaseHasGlyphs),
+	('AddSubstitution', PhaseAddSubstitution),
+	('AddGlyphsToClass', PhaseAddGlyphsToClass),
+	('DeflateClassString', PhaseDeflateClassString),
+	('AddPairPositioning', PhaseAddPairPositioning),
+	('GetFDKFeatureContent', PhaseGetFDKFeatureContent),
+	('GetFDKCode', PhaseGetFDKCode),
+	]
+
+
+## Measuring
+
+def PeakResidentBytes():
+	'''
+	Peak resident set size of this process in bytes since it was last reset, or None if unavailable.
+	'''
+	try:
+		f = open('/proc/self/status')
+		try:
+			for line in f:
+				if line.startswith('VmHWM:'):
+					return int(line.split()[1]) * 1024 # kilobytes
+		finally:
+			f.close()
+	except (IOError, OSError):
+		pass
+	return None
+
+def ResetPeakResidentBytes():
+	'''
+	Reset the peak resident set size of this process to the current resident set size. Returns False if that is not possible.
+	'''
+	try:
+		f = open('/proc/self/clear_refs', 'w')
+		try:
+			f.write('5')
+		finally:
+			f.close()
+	except (IOError, OSError):
+		return False
+	return PeakResidentBytes() is not None
+
+def PeakMemoryMethod():
+	'''
+	Returns how the peak memory of phases can be measured: 'tracemalloc', 'vmhwm' or None if it can't.
+	'''
+	if tracemalloc is not None:
+		return 'tracemalloc'
+	if ResetPeakResidentBytes():
+		return 'vmhwm'
+	return None
+
+def Measure(function, method = None):
+	'''
+	Call function, returns (result, seconds, peak bytes during the call or None, growth of the resident set size or None).
+	"method" is the PeakMemoryMethod() to measure the peak with, None for no peak.
+	'''
+	if method == 'tracemalloc':
+		tracemalloc.start()
+	rss = ResidentBytes()
+	if method == 'vmhwm':
+		ResetPeakResidentBytes()
+	start = time.time()
+	result = function()
+	seconds = time.time() - start
+	rssgrowth = None
+	if rss is not None:
+		rssgrowth = ResidentBytes() - rss
+	peak = None
+	if method == 'tracemalloc':
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+	elif method == 'vmhwm':
+		peak = PeakResidentBytes() - rss
+	return result, seconds, peak, rssgrowth
+
+def RunScenario(name, repeat = 3, memory = False):
+	'''
+	Returns ordered dictionary of results of one scenario, with the fastest of "repeat" runs per phase.
+	With "memory", the peak memory of each phase is measured too. Raises ValueError if that is not possible.
+	'''
+	font = Scenario(name)
+	phases = OrderedDict()
+	method = None
+	if memory:
+		method = PeakMemoryMethod()
+		if method is None:
+			raise ValueError('Peak memory can\'t be measured: tracemalloc (Python 3.4 and later) or a resettable peak resident set size (Linux 4.0 and later) is needed')
+
+	for i in range(repeat):
+		shoes = None
+		for phasename, phase in PHASES:
+			if phase is None:
+				shoes, seconds, peak, rssgrowth = Measure(lambda: DancingShoes(font.glyphnames, font.features), method)
+				operations = len(font.glyphnames)
+			else:
+				operations, seconds, peak, rssgrowth = Measure(lambda: phase(font, shoes), method)
+			result = phases.get(phasename)
+			if result is not None:
+				if result['peakbytes'] is not None:
+					peak = max(peak, result['peakbytes'])
+				if result['rssgrowthbytes'] is not None:
+					rssgrowth = max(rssgrowth, result['rssgrowthbytes'])
+			if result is None or seconds < result['seconds']:
+				phases[phasename] = OrderedDict([
+					('seconds', seconds),
+					('operations', operations),
+					('peakbytes', peak),
+					('rssgrowthbytes', rssgrowth),
+					])
+			else:
+				result['peakbytes'] = peak
+				result['rssgrowthbytes'] = rssgrowth
+
+	return OrderedDict([
+		('scenario', name),
+		('glyphs', font.glyphcount),
+		('pairs', font.paircount),
+		('lookups', len(shoes.lookups)),
+		('phases', phases),
+		('lookupbytes', LookupRecordSizes(shoes)),
+		])
+
+def RunBenchmarks(scenarios = ('small', 'medium'), repeat = 3, memory = False):
+	'''
+	Returns ordered dictionary of environment information and the results of all scenarios.
+	'''
+	results = OrderedDict([
+		('dancingshoes', dancingshoes.__version__),
+		('python', platform.python_version()),
+		('platform', platform.platform()),
+		('memory', memory and PeakMemoryMethod() or None),
+		('scenarios', []),
+		])
+	for name in scenarios:
+		results['scenarios'].append(RunScenario(name, repeat, memory))
+	return results
+
+
+## Lookup record sizes
+
+# Lookup fields holding interned strings, which are shared by all records and not counted
+SHAREDFIELDS = set(['feature', 'script', 'language', 'lookupflag'])
+
+def ObjectBytes(value, seen):
+	'''
+	Size of value in bytes including the items of tuples and lists, counting objects in "seen" only once.
+	'''
+	if id(value) in seen:
+		return 0
+	seen.add(id(value))
+	size = sys.getsizeof(value)
+	if isinstance(value, (tuple, list)):
+		for item in value:
+			size += ObjectBytes(item, seen)
+	return size
+
+def LookupRecordSizes(shoes):
+	'''
+	Returns ordered dictionary of lookup type -> {'records', 'bytes'}: the number of lookup records and the average bytes
+	per record, including the values that only the record refers to. Pair blocks are counted per pair.
+	'''
+	totals = OrderedDict()
+	seen = set()
+	for lookup in shoes.lookups:
+		size = sys.getsizeof(lookup)
+		for name in lookup.__slots__:
+			if not name in SHAREDFIELDS:
+				size += ObjectBytes(getattr(lookup, name), seen)
+		total = totals.setdefault(lookup.type, [0, 0])
+		total[0] += lookup.type == 'GPOSPairBlock' and len(lookup) or 1
+		total[1] += size
+	sizes = OrderedDict()
+	for lookuptype, (records, size) in totals.items():
+		sizes[lookuptype] = OrderedDict([('records', records), ('bytes', size / float(records))])
+	return sizes
+
+
+## Comparing
+
+def Compare(baseline, results, tolerance = 1.25, minimum = 0.05):
+	'''
+	Returns list of regression descriptions: phases that take more than "tolerance" times as long as in the baseline.
+	Phases taking less than "minimum" seconds in both are ignored as noise.
+	'''
+	baselinescenarios = dict([(scenario['scenario'], scenario) for scenario in baseline['scenarios']])
+	regressions = []
+	for scenario in results['scenarios']:
+		if not scenario['scenario'] in baselinescenarios:
+			continue
+		basephases = baselinescenarios[scenario['scenario']]['phases']
+		for phasename, phase in scenario['phases'].items():
+			if not phasename in basephases:
+				continue
+			before = basephases[phasename]['seconds']
+			after = phase['seconds']
+			if max(before, after) >= minimum and after > before * tolerance:
+				regressions.append('%s/%s: %.3fs -> %.3fs (%.2fx)' % (scenario['scenario'], phasename, before, after, after / max(before, 1e-9)))
+	return regressions
+
+def Report(results):
+	'''
+	Returns human-readable table of results as a string.
+	'''
+	lines = []
+	for scenario in results['scenarios']:
+		lines.append('%s: %s glyphs, %s pairs, %s lookups' % (scenario['scenario'], scenario['glyphs'], scenario['pairs'], scenario['lookups']))
+		for phasename, phase in scenario['phases'].items():
+			peak = ''
+			if phase['peakbytes'] is not None:
+				peak = ' %10s bytes peak' % (phase['peakbytes'])
+			lines.append('  %-22s %9.4fs %10s ops %10s bytes growth%s' % (phasename, phase['seconds'], phase['operations'], phase['rssgrowthbytes'], peak))
+		for lookuptype, size in scenario['lookupbytes'].items():
+			lines.append('  %-22s %10s records %7.1f bytes per record' % (lookuptype, size['records'], size['bytes']))
+	return '\n'.join(lines)
+
+
+def main(arguments = None):
+	parser = optparse.OptionParser(usage = 'python -m benchmarks.run [options]')
+	parser.add_option('--scenarios', default = 'small,medium', help = 'comma-separated scenarios out of: %s' % (', '.join(SCENARIOS.keys())))
+	parser.add_option('--repeat', type = 'int', default = 3, help = 'runs per scenario, the fastest run per phase is reported')
+	parser.add_option('--memory', action = 'store_true', default = False, help = 'measure peak memory per phase, with tracemalloc or the peak resident set size')
+	parser.add_option('--output', help = 'write JSON results to this file instead of standard output')
+	parser.add_option('--compare', help = 'JSON results file to compare against')
+	parser.add_option('--tolerance', type = 'float', default = 1.25, help = 'slowdown factor regarded as a regression')
+	parser.add_option('--minimum', type = 'float', default = 0.05, help = 'phases taking less seconds than this are not compared, as their timings are mostly noise')
+	options, args = parser.parse_args(arguments)
+	if options.memory and PeakMemoryMethod() is None:
+		parser.error('--memory needs tracemalloc (Python 3.4 and later) or a resettable peak resident set size (Linux 4.0 and later)')
+
+	results = RunBenchmarks(options.scenarios.split(','), options.repeat, options.memory)
+
+	text = json.dumps(results, indent = 1, separators = (',', ': '))
+	if options.output:
+		f = open(options.output, 'w')
+		try:
+			f.write(text)
+		finally:
+			f.close()
+		sys.stderr.write(Report(results) + '\n')
+	else:
+		sys.stdout.write(text + '\n')
+
+	if options.compare:
+		f = open(options.compare, 'r')
+		try:
+			baseline = json.load(f)
+		finally:
+			f.close()
+		regressions = Compare(baseline, results, options.tolerance, options.minimum)
+		if regressions:
+			sys.stderr.write('REGRESSIONS:\n' + '\n'.join(regressions) + '\n')
+			return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
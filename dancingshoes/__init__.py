@@ -35,10 +35,19 @@ EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 """
 
-import string, os, re, copy
-import dancingshoes.opentypenames
-
-__all__ = ['opentypenames', 'helpers']
+import string, os, sys, re, copy, array, time, types, hashlib
+from collections import OrderedDict
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+try:
+	import resource
+except ImportError:
+	resource = None
+__all__ = ['opentypenames', 'helpers', 'substitutiondb', 'batch', 'parallel', 'cache']
 __version__ = '0.1.3'
 
 
@@ -48,44 +57,180 @@ __version__ = '0.1.3'
 
 class DancingShoes:
 	def __init__(self, glyphnames, features):
-		self.glyphnames = glyphnames # List of glyph names
+		self.repertoire = GlyphRepertoire(glyphnames) # Set-backed glyph repertoire, all presence checks go through here
+		self.glyphnames = self.repertoire.Glyphs() # List of glyph names, in original order
 		self.features = features # List four-digit feature name codes, in order preferred by the foundry/designer
 		self.lookups = [] # List of OpenType lookups. This is the main list and will be filled later
-		self.glyphgroups = CollectGlyphGroups(self.glyphnames) # Dict of groups. glyphgroups['.tosf'] = ['one.tosf', 'two.tosf', 'three.tosf' ...]
-		self.classes = Ddict(dict) # Two dimensional array of classes.
+		self.lookupindex = OrderedDict() # Nested index of self.lookups: lookupindex[feature][script][language][lookupflag] = [lookup, lookup ...]
+		self.scriptsandlanguages = OrderedDict() # All registered (script, language) tuples, in order of appearance
+		self.lookupdigest = '' # Digest of self.lookups up to self.lookupdigested, chained over blocks of LOOKUPDIGESTBLOCK lookups. See LookupsDigest()
+		self.lookupdigested = 0 # Number of lookups in self.lookupdigest
+		self.classdigests = {} # classdigests[classname] = digest of the class's glyphs, dropped when the class changes
+		self.glyphgroups = CollectGlyphGroups(self.glyphnames) # Suffix index of groups. glyphgroups['.tosf'] = ['one.tosf', 'two.tosf', 'three.tosf' ...]
+		self.classes = Ddict(GlyphClass) # Dict of classes. classes['@smcp_source'] = GlyphClass(['a', 'b' ...])
+		self.namecomments = True # Put out comments with the descriptive names of features, scripts and languages. False skips loading the names
+		self.subtablesize = 60000 # Estimated size in bytes at which class pair positionings are broken into a new subtable, None for no breaks
+
+		# LRU cache of DeflateClassString() results
+		self.deflatecache = OrderedDict() # deflatecache[string] = (glyphlist, referenced class names)
+		self.deflatecachesize = 4096 # Maximum number of cached strings
+		self.deflatecachereferences = {} # deflatecachereferences['@classname'] = set of cached strings referencing that class
+		self.deflatecachehits = 0
+		self.deflatecachemisses = 0
+
+		# Incremental regeneration
+		self.dirtyfeatures = set() # Features whose lookups changed since their content was last generated
+		self.pairfeatures = set() # Features with pair positionings, whose content depends on class sizes through the subtable breaks
+		self.dirtyclasses = set() # Classes that changed since ChangedClasses() was last called
+		self.cachefeaturecontents = False # Keep generated feature texts for reuse, switched on by ChangedFeatureContents()
+		self.featurecontentcache = {} # featurecontentcache[feature] = ((codeversion, subtablesize, namecomments), text) of the last GetFDKFeatureContent()
+		self.deliveredfeatures = {} # deliveredfeatures[feature] = text last returned by ChangedFeatureContents()
+		self.deliveredclasses = {} # deliveredclasses[classname] = code last returned by ChangedClasses()
+
+		self.profiler = None # Profiler, set by EnableProfiling()
 		
+		# Diagnostics, recorded as Diagnostic objects and formatted only when put out
 		self.infos = []
 		self.warnings = []
 		self.errors = []
+		self.diagnosticcounts = {} # diagnosticcounts[code] = number of diagnostics of that code, recorded or not
+		self.diagnosticthreshold = INFO # Diagnostics of lower severity are only counted, not recorded
+		self.diagnosticlimit = None # Maximum number of recorded diagnostics per code, None for no limit
 
 	def Info(self, string):
-		self.infos.append(string)
+		self.Diagnose('info', message = string)
 
 	def Infos(self):
-		if self.infos:
-			return 'INFORMATIONS:\n' + '\n'.join(self.infos)
-		else:
-			return None
+		return self.DiagnosticsText('INFORMATIONS', INFO)
 
 	def Warning(self, string):
-		self.warnings.append(string)
+		self.Diagnose('warning', message = string)
 
 	def Warnings(self):
-		if self.warnings:
-			return 'WARNINGS:\n' + '\n'.join(self.warnings)
-		else:
-			return None
+		return self.DiagnosticsText('WARNINGS', WARNING)
 
 	def Error(self, string):
-		self.errors.append(string)
+		self.Diagnose('error', message = string)
 
 	def Errors(self):
-		if self.errors:
-			return 'ERRORS:\n' + '\n'.join(self.errors)
+		return self.DiagnosticsText('ERRORS', ERROR)
+
+	def Diagnose(self, code, feature = None, glyphs = None, **arguments):
+		'''
+		Count a diagnostic of one of the codes in DIAGNOSTICS, and record it unless its severity is below
+		self.diagnosticthreshold or self.diagnosticlimit diagnostics of this code have been recorded already.
+		"glyphs" is a list of the glyphs concerned, or a function returning it that is only called if the diagnostic is recorded.
+		Returns True if the diagnostic was recorded.
+		'''
+		count = self.diagnosticcounts.get(code, 0) + 1
+		self.diagnosticcounts[code] = count
+		severity = DIAGNOSTICS[code][0]
+		if severity < self.diagnosticthreshold or (self.diagnosticlimit is not None and count > self.diagnosticlimit):
+			return False
+		if callable(glyphs):
+			glyphs = glyphs()
+		self.DiagnosticRecords(severity).append(Diagnostic(code, feature, glyphs, arguments))
+		return True
+
+	def DiagnosticRecords(self, severity):
+		'''
+		Returns list of recorded Diagnostic objects of a severity.
+		'''
+		if severity == INFO:
+			return self.infos
+		elif severity == WARNING:
+			return self.warnings
+		return self.errors
+
+	def DiagnosticCounts(self, severity = None):
+		'''
+		Returns dictionary of code -> number of diagnostics, including those that were not recorded.
+		"severity" optionally restricts the codes to one severity.
+		'''
+		counts = {}
+		for code, count in self.diagnosticcounts.items():
+			if severity is None or DIAGNOSTICS[code][0] == severity:
+				counts[code] = count
+		return counts
+
+	def DiagnosticsText(self, title, severity):
+		'''
+		Returns the recorded diagnostics of a severity as text, followed by the number of those not recorded because of self.diagnosticlimit.
+		'''
+		records = self.DiagnosticRecords(severity)
+		lines = [record.Message() for record in records]
+		if self.diagnosticlimit is not None and severity >= self.diagnosticthreshold:
+			for code, count in sorted(self.DiagnosticCounts(severity).items()):
+				if count > self.diagnosticlimit:
+					lines.append('(%s more "%s" message(s) not shown)' % (count - self.diagnosticlimit, code))
+		if lines:
+			return title + ':\n' + '\n'.join(lines)
 		else:
 			return None
 
 
+	## Profiling
+
+	def EnableProfiling(self, memory = False):
+		'''
+		Record call counts, cumulative wall time and, if "memory" is set, allocated bytes
+		of all public methods and of the emission phases (languagesystem, classes, each feature).
+		Allocated bytes are traced with tracemalloc where available (Python 3.4 and later). Otherwise they are approximated
+		by the growth of the resident set size of the process, which is coarse (whole memory pages, memory of other threads).
+		Methods are wrapped on this object only while profiling is enabled, so there is no overhead otherwise.
+		'''
+		if self.profiler is not None and self.profiler.enabled:
+			return
+		self.profiler = Profiler(memory)
+		for name in dir(self.__class__):
+			if name[:1].isupper() and not name in PROFILINGEXCLUDEDMETHODS and callable(getattr(self, name)):
+				setattr(self, name, self.profiler.Wrap(name, getattr(self, name)))
+				self.profiler.wrapped.append(name)
+
+	def DisableProfiling(self):
+		'''
+		Remove the method wrappers again. The recorded profile is kept until profiling is enabled again.
+		'''
+		if self.profiler is None or not self.profiler.enabled:
+			return
+		for name in self.profiler.wrapped:
+			if name in self.__dict__:
+				del self.__dict__[name]
+		self.profiler.Stop()
+
+	def ProfilePhase(self, name, chunks):
+		'''
+		Returns chunks of an emission phase, counted as phase "name" while profiling is enabled.
+		'''
+		if self.profiler is not None and self.profiler.enabled:
+			return self.profiler.Phase(name, chunks)
+		return chunks
+
+	def ProfileReport(self):
+		'''
+		Returns the recorded profile as dictionary {'methods': {name: {'calls', 'seconds', 'bytes'}}, 'phases': {...}, 'memory': ...},
+		methods ordered by cumulative time, phases in order of emission. "bytes" is None without memory profiling.
+		"memory" is 'tracemalloc', 'rss' if the bytes are approximated from the resident set size, or None.
+		Returns None if profiling was never enabled.
+		'''
+		if self.profiler is None:
+			return None
+		return self.profiler.Report()
+
+	def Profile(self):
+		if self.profiler is None:
+			return None
+		report = self.profiler.Report()
+		lines = ['PROFILE:']
+		for section in ('methods', 'phases'):
+			for name, record in report[section].items():
+				memory = ''
+				if record['bytes'] is not None:
+					memory = ', %s%s bytes' % (report['memory'] == 'rss' and '~' or '', record['bytes'])
+				lines.append('%s: %s call(s), %.4fs%s' % (name, record['calls'], record['seconds'], memory))
+		return '\n'.join(lines)
+
+
 	def Glyphs(self):
 		'''
 		Returns self.glyphnames
@@ -99,27 +244,25 @@ class DancingShoes:
 		Return True, if all submitted glyphs are present.
 		'''
 		if isinstance(glyphslist, str):
-			if glyphslist in self.glyphnames:
+			if glyphslist in self.repertoire:
 				return True
 				
 		elif isinstance(glyphslist, list) or isinstance(glyphslist, tuple):
+			return self.repertoire.HasAllGlyphs(glyphslist)
 
-#			from sets import Set
-#			if len(glyphslist) == len( list(Set(glyphslist) & Set(self.glyphnames)) ):
-#				return True
-#			else:
-#				return False
 
-			present = 0
-			for glyph in glyphslist:
-				if glyph in self.glyphnames:
-#				if InList(self.glyphnames, glyph):
-					present += 1
+	def HasAllGlyphs(self, glyphslist):
+		'''
+		Return True, if all glyphs of the submitted list are present in the glyph repertoire.
+		'''
+		return self.repertoire.HasAllGlyphs(glyphslist)
 
-			if present == len(glyphslist):
-				return True
-			else:
-				return False
+
+	def MissingGlyphs(self, glyphslist):
+		'''
+		Return list of those submitted glyphs that are missing in the glyph repertoire, in submitted order.
+		'''
+		return self.repertoire.MissingGlyphs(glyphslist)
 
 	def Groups(self):
 		'''
@@ -134,18 +277,14 @@ class DancingShoes:
 		Return True, if all submitted glyphs are present.
 		'''
 		if isinstance(groupslist, str):
-			if groupslist in self.Groups():
+			if groupslist in self.glyphgroups:
 				return True
 
 		elif isinstance(groupslist, list) or isinstance(groupslist, tuple):
-			present = 0
 			for group in groupslist:
-				if group in self.Groups():
-					present += 1
-			if present == len(groupslist):
-				return True
-			else:
-				return False
+				if not group in self.glyphgroups:
+					return False
+			return True
 		else:
 			return False
 
@@ -153,14 +292,14 @@ class DancingShoes:
 	def HasClasses(self, classnames):
 		
 		if isinstance(classnames, str):
-			if self.classes.has_key(classnames):
+			if classnames in self.classes:
 				return True
 
 		elif isinstance(classnames, list) or isinstance(classnames, tuple):
 
 			present = 0
 			for classname in classnames:
-				if self.classes.has_key(classname):
+				if classname in self.classes:
 					present += 1
 			
 			if present == len(classnames):
@@ -176,39 +315,25 @@ class DancingShoes:
 		'''
 		Returns self.glyphgroups[ending]
 		'''
-		if ending in self.Groups():
-			return self.glyphgroups[ending]
-		else:
-			return []
+		return self.glyphgroups.GlyphsInGroup(ending)
 
 
 	def GroupHasGlyphs(self, ending, glyphslist):
 		'''
 		Returns True if all glyphs are present in group
 		'''
-		if ending in self.Groups():
-
-			if isinstance(glyphslist, str):
-				if glyphslist in self.GlyphsInGroup(ending):
-					return True
-
-			elif isinstance(glyphslist, list) or isinstance(glyphslist, tuple):
-				present = 0
-				for glyph in glyphslist:
-					if glyph in self.GlyphsInGroup(ending):
-						present += 1
-				if present == len(glyphslist):
-					return True
-				else:
-					return False
-		else:
-			return False
+		return self.glyphgroups.GroupHasGlyphs(ending, glyphslist)
 
 
+	def GroupsOfGlyph(self, glyph):
+		'''
+		Returns list of all groups (suffixes) that contain the glyph. GroupsOfGlyph('a.sc.ss01') = ['.ss01', '.sc.ss01']
+		'''
+		return self.glyphgroups.GroupsOfGlyph(glyph)
 
 
 	def SourceGlyphFromTarget(self, target):
-		return os.path.splitext(target)[0]
+		return self.glyphgroups.BaseGlyph(target)
 
 
 	def UsedFeatures(self):
@@ -217,9 +342,8 @@ class DancingShoes:
 		'''
 		list = []
 		for feature in self.features:
-			for lookup in self.lookups:
-				if feature == lookup.feature and not lookup.feature in list:
-					list.append(lookup.feature)
+			if feature in self.lookupindex and not feature in list:
+				list.append(feature)
 		return list
 
 
@@ -237,12 +361,11 @@ class DancingShoes:
 		been registered for a specific script/language or for all default scripts/languages(Used for the FDK version switch).
 		'''
 		list = []
-		for lookup in self.lookups:
-			if feature == lookup.feature and not lookup.script in list:
-				if includedefault and lookup.script == '__DEFAULT__':
-					list.append(lookup.script)
-				if includeforeign and lookup.script != '__DEFAULT__':
-					list.append(lookup.script)
+		for script in self.lookupindex.get(feature, {}):
+			if includedefault and script == '__DEFAULT__':
+				list.append(script)
+			if includeforeign and script != '__DEFAULT__':
+				list.append(script)
 		return list
 
 
@@ -252,22 +375,21 @@ class DancingShoes:
 		been registered for a specific script/language or for all default scripts/languages(Used for the FDK version switch).
 		'''
 		list = []
-		for lookup in self.lookups:
-			if feature == lookup.feature and script == lookup.script and not lookup.language in list:
-				if includedefault and lookup.language == '__DEFAULT__':
-					list.append(lookup.language)
-				if includeforeign and lookup.language != '__DEFAULT__':
-					list.append(lookup.language)
+		for language in self.lookupindex.get(feature, {}).get(script, {}):
+			if includedefault and language == '__DEFAULT__':
+				list.append(language)
+			if includeforeign and language != '__DEFAULT__':
+				list.append(language)
 		return list
 
 
 	def UsedLookUpFlags(self, feature, script, language):
 		'''	Returns list of all lookupflags that have been registered for given feature and script and language.
+		The lookupflags are returned in dictionary order, as they always have been: it decides the order of the lookups in the feature code.
 		'''
 		list = {}
-		for lookup in self.lookups:
-			if feature == lookup.feature and script == lookup.script and language == lookup.language:
-				list[lookup.lookupflag] = 'used'
+		for lookupflag in self.lookupindex.get(feature, {}).get(script, {}).get(language, {}):
+			list[lookupflag] = 'used'
 		return list.keys()
 
 
@@ -275,21 +397,21 @@ class DancingShoes:
 		'''
 		Returns list of all lookups that have been registered for given feature and script and language.
 		'''
-		list = []
-		for lookup in self.lookups:
-			if language == lookup.language and feature == lookup.feature and script == lookup.script and lookupflag == lookup.lookupflag:
-				list.append(lookup)
-		return list
+		return [lookup for lookup in self.IterLookups(feature, script, language, lookupflag)]
+
+
+	def IterLookups(self, feature, script, language, lookupflag):
+		'''
+		Returns iterator over all lookups that have been registered for given feature and script and language, without copying them.
+		'''
+		return iter(self.lookupindex.get(feature, {}).get(script, {}).get(language, {}).get(lookupflag, []))
 
 
 	def UsedScriptsAndLanguages(self):
 		'''
 		Returns list of tuples of all script/language combinations that have been registered.
 		'''
-		list = []
-		for lookup in self.lookups:
-			if not (lookup.script, lookup.language) in list:
-				list.append((lookup.script, lookup.language))
+		list = [scriptandlanguage for scriptandlanguage in self.scriptsandlanguages]
 
 		# Add dflt/dflt and ltn/dflt
 		if not ('__DEFAULT__', '__DEFAULT__') in list:
@@ -302,14 +424,94 @@ class DancingShoes:
 
 	## Add lookups
 
+	def RegisterLookup(self, lookup):
+		'''
+		Append lookup to self.lookups and file it in the feature/script/language/lookupflag index.
+		All Add* methods go through here.
+		'''
+		self.lookups.append(lookup)
+		self.IndexLookup(lookup)
+
+
+	def IndexLookup(self, lookup):
+		'''
+		File lookup in the feature/script/language/lookupflag index without appending it to self.lookups.
+		'''
+		scripts = self.lookupindex.get(lookup.feature)
+		if scripts is None:
+			scripts = self.lookupindex[lookup.feature] = OrderedDict()
+		languages = scripts.get(lookup.script)
+		if languages is None:
+			languages = scripts[lookup.script] = OrderedDict()
+		lookupflags = languages.get(lookup.language)
+		if lookupflags is None:
+			lookupflags = languages[lookup.language] = OrderedDict()
+		lookups = lookupflags.get(lookup.lookupflag)
+		if lookups is None:
+			lookups = lookupflags[lookup.lookupflag] = []
+		lookups.append(lookup)
+		self.scriptsandlanguages[(lookup.script, lookup.language)] = True
+		self.dirtyfeatures.add(lookup.feature)
+		if isinstance(lookup, GPOSLookupType2) or isinstance(lookup, GPOSPairBlock):
+			self.pairfeatures.add(lookup.feature)
+
+
+	def ReindexLookups(self):
+		'''
+		Rebuild the lookup index and digest from self.lookups. Call after manipulating self.lookups directly.
+		'''
+		self.IndexLookups()
+		self.lookupdigest = ''
+		self.lookupdigested = 0
+
+
+	def IndexLookups(self):
+		'''
+		Rebuild the lookup index from self.lookups.
+		'''
+		self.dirtyfeatures.update(self.lookupindex.keys())
+		self.lookupindex = OrderedDict()
+		self.scriptsandlanguages = OrderedDict()
+		self.pairfeatures = set()
+		for lookup in self.lookups:
+			self.IndexLookup(lookup)
+
+
+	def LookupsDigest(self):
+		'''
+		Returns hexadecimal digest of all lookups in order. Equal lookups give equal digests.
+		Completed blocks of LOOKUPDIGESTBLOCK lookups are digested only once, so later calls only digest the lookups added since.
+		'''
+		while len(self.lookups) - self.lookupdigested >= LOOKUPDIGESTBLOCK:
+			block = self.lookups[self.lookupdigested:self.lookupdigested + LOOKUPDIGESTBLOCK]
+			self.lookupdigest = Digest(self.lookupdigest + '\n' + '\n'.join([LookupDigestLine(lookup) for lookup in block]))
+			self.lookupdigested += LOOKUPDIGESTBLOCK
+		if self.lookupdigested < len(self.lookups):
+			return Digest(self.lookupdigest + '\n' + '\n'.join([LookupDigestLine(lookup) for lookup in self.lookups[self.lookupdigested:]]))
+		return Digest(self.lookupdigest)
+
+
+	def ClassesDigest(self):
+		'''
+		Returns hexadecimal digest of all classes and their glyphs. Digests of unchanged classes are reused.
+		'''
+		digests = []
+		for classname in sorted(self.classes.keys()):
+			digest = self.classdigests.get(classname)
+			if digest is None:
+				digest = self.classdigests[classname] = Digest('\n'.join(self.classes[classname]))
+			digests.append(classname + ' ' + digest)
+		return Digest('\n'.join(digests))
+
+
 	def AddFeatureLookup(self, feature, lookupfeature, script = '', language = '', lookupflag = '', comment = ''):
 
 		# Check if feature is present in main feature list
 		if not feature in self.features:
-			self.Warning('Attempting to add feature lookup to feature "%s", but the feature is not present in your features list' % (feature))
+			self.Diagnose('unknown-feature', feature, kind = 'feature lookup')
 
 		if not lookupfeature in self.UsedFeatures():
-			self.Info('Attempting to add feature "%s" lookup to feature "%s", but the feature is not in use (yet)' % (lookupfeature, feature))
+			self.Diagnose('feature-not-in-use', feature, lookupfeature = lookupfeature)
 
 		if not script:
 			script = '__DEFAULT__'
@@ -317,26 +519,26 @@ class DancingShoes:
 			language = '__DEFAULT__'
 		if not lookupflag:
 			lookupflag = '__DEFAULT__'
-		self.lookups.append(FeatureLookup(feature, script, language, lookupflag, lookupfeature, comment))
+		self.RegisterLookup(FeatureLookup(feature, script, language, lookupflag, lookupfeature, comment))
 
 
 	def AddSimpleSubstitutionFeature(self, feature, ending):
 
 		# Check if feature is present in main feature list
 		if not feature in self.features:
-			self.Warning('Attempting to add simple substitutions to feature "%s", but the feature is not present in your supplied features list' % (feature))
+			self.Diagnose('unknown-feature', feature, kind = 'simple substitutions')
 
 		if self.HasGroups([ending]):
 			self.AddEndingToBothClasses(feature, ending)
 			self.AddSubstitution(feature, '@' + feature + '_source', '@' + feature + '_target')
 		else:
-			self.Info('Attempting to add simple substitution feature "%s", but group "%s" is missing in your glyph repertoire.' % (feature, ending))
+			self.Diagnose('missing-group', feature, ending = ending)
 
 	def AddSubstitution(self, feature, source, target, script = '', language = '', lookupflag = '', comment = ''):
 
 		# Check if feature is present in main feature list
 		if not feature in self.features:
-			self.Warning('Attempting to add substitution to feature "%s", but the feature is not present in your supplied features list' % (feature))
+			self.Diagnose('unknown-feature', feature, kind = 'substitution')
 
 		if not script:
 			script = '__DEFAULT__'
@@ -348,11 +550,60 @@ class DancingShoes:
 
 		# source and target sequence code is checked for presence
 		if self.HasGlyphs(self.DeflateClassString(source)) and self.HasGlyphs(self.DeflateClassString(target)):
-			self.lookups.append(GSUBLookup(feature, source, target, script, language, lookupflag, comment))
+			self.RegisterLookup(GSUBLookup(feature, source, target, script, language, lookupflag, comment))
 		else:
-			self.Info('Attempting to add substitution glyph sequence to feature "%s", but glyphs from either the source ("%s") or the target ("%s") are missing in your glyph repertoire.' % (feature, source, target))
+			self.Diagnose('missing-substitution-glyphs', feature, lambda: self.MissingGlyphs(self.DeflateClassString(source) + self.DeflateClassString(target)), source = source, target = target)
 			
 
+	def AddSubstitutions(self, rows):
+		'''
+		Add substitutions from any iterable of (feature, source, target, script, language, lookupflag, comment) tuples,
+		such as helpers.SubstitutionsFromCSV(). Trailing fields may be omitted. Rows are consumed lazily.
+		Feature checks and glyph presence checks are cached per distinct feature and glyph sequence.
+		Instead of one Info per rejected row, returns a summary dictionary:
+		{'accepted': n, 'rejected': n, 'rejectedfeatures': {feature: n}}
+		'''
+
+		knownfeatures = {}
+		present = {}
+		accepted = 0
+		rejected = 0
+		rejectedfeatures = {}
+
+		for row in rows:
+			feature, source, target, script, language, lookupflag, comment = (tuple(row) + ('', '', '', '', ''))[:7]
+
+			# Check if feature is present in main feature list, once per feature
+			if not feature in knownfeatures:
+				knownfeatures[feature] = feature in self.features
+				if not knownfeatures[feature]:
+					self.Diagnose('unknown-feature', feature, kind = 'substitutions')
+
+			if not script:
+				script = '__DEFAULT__'
+			if not language:
+				language = '__DEFAULT__'
+			if not lookupflag:
+				lookupflag = '__DEFAULT__'
+
+			# source and target sequence code is checked for presence, once per sequence
+			for sequence in (source, target):
+				if not sequence in present:
+					present[sequence] = self.HasAllGlyphs(self.DeflateClassString(sequence))
+
+			if present[source] and present[target]:
+				self.RegisterLookup(GSUBLookup(feature, source, target, script, language, lookupflag, comment))
+				accepted += 1
+			else:
+				rejected += 1
+				rejectedfeatures[feature] = rejectedfeatures.get(feature, 0) + 1
+
+		if rejected:
+			self.Diagnose('rejected-substitutions', rejected = rejected, rejectedfeatures = rejectedfeatures)
+
+		return {'accepted': accepted, 'rejected': rejected, 'rejectedfeatures': rejectedfeatures}
+
+
 	#def AddDuplicateFeature(self, sourcefeature, targetfeature):
 	#	self.AddFeatureLookup(targetfeature, '', '', '', sourcefeature, '')
 
@@ -369,13 +620,13 @@ class DancingShoes:
 		
 		# Check if feature is present in main feature list
 		if not feature in self.features:
-			self.Warning('Attempting to add single positioning lookup to feature "%s", but the feature is not present in your supplied features list' % (feature))
+			self.Diagnose('unknown-feature', feature, kind = 'single positioning lookup')
 
 		if isinstance(adjustment, int) or isinstance(adjustment, str):
 			adjustment = (int(adjustment), 0, 0, 0)
 	
 		if self.HasGlyphs(self.DeflateClassString(glyph)):
-			self.lookups.append(GPOSLookupType1(feature, glyph, adjustment, script, language, lookupflag, comment))
+			self.RegisterLookup(GPOSLookupType1(feature, glyph, adjustment, script, language, lookupflag, comment))
 
 
 	def AddPairPositioning(self, feature, pair, adjustment, script = '', language = '', lookupflag = '', comment = ''):
@@ -389,51 +640,447 @@ class DancingShoes:
 
 		# Check if feature is present in main feature list
 		if not feature in self.features:
-			self.Warning('Attempting to add pair positioning lookup to feature "%s", but the feature is not present in your supplied features list' % (feature))
+			self.Diagnose('unknown-feature', feature, kind = 'pair positioning lookup')
 
 		if isinstance(adjustment, int) or isinstance(adjustment, str):
 			adjustment = (int(adjustment), 0, 0, 0)
 	
 		if self.HasGlyphs(self.DeflateClassString(pair)):
-			self.lookups.append(GPOSLookupType2(feature, pair, adjustment, script, language, lookupflag, comment))
+			self.RegisterLookup(GPOSLookupType2(feature, pair, adjustment, script, language, lookupflag, comment))
+
+
+	def AddPairPositioningBatch(self, feature, lefts, rights, adjustments, script = '', language = '', lookupflag = '', comment = ''):
+		'''
+		Add many pair positionings of one feature/script/language/lookupflag at once.
+		"lefts", "rights" and "adjustments" are parallel sequences. Adjustments can be integers, four-tuples,
+		an array.array of integers or anything with a tolist() method, such as a NumPy array.
+		Glyph presence is checked once per distinct glyph, and the pairs are stored in one columnar GPOSPairBlock.
+		Returns the number of pairs that were added.
+		'''
+
+		if not script:
+			script = '__DEFAULT__'
+		if not language:
+			language = '__DEFAULT__'
+		if not lookupflag:
+			lookupflag = '__DEFAULT__'
+
+		# Check if feature is present in main feature list
+		if not feature in self.features:
+			self.Diagnose('unknown-feature', feature, kind = 'pair positioning lookups')
+
+		if hasattr(lefts, 'tolist'):
+			lefts = lefts.tolist()
+		if hasattr(rights, 'tolist'):
+			rights = rights.tolist()
+		if not isinstance(adjustments, array.array) and hasattr(adjustments, 'tolist'):
+			adjustments = adjustments.tolist()
+
+		if not len(lefts) == len(rights) == len(adjustments):
+			self.Diagnose('pair-length-mismatch', feature, lefts = len(lefts), rights = len(rights), adjustments = len(adjustments))
+			return 0
+
+		# Presence check, once per distinct glyph name or class
+		missing = set()
+		for name in set(lefts) | set(rights):
+			if not self.HasAllGlyphs(self.DeflateClassString(name)):
+				missing.add(name)
+
+		if isinstance(adjustments, array.array):
+			# Copied, so that the block doesn't change with the caller's array, and as integers whatever the typecode
+			values = array.array('l', [int(value) for value in adjustments])
+		else:
+			values = PairBlockValues(adjustments)
+
+		if missing:
+			keep = [i for i in range(len(lefts)) if not lefts[i] in missing and not rights[i] in missing]
+			lefts = [lefts[i] for i in keep]
+			rights = [rights[i] for i in keep]
+			if isinstance(values, array.array):
+				values = array.array('l', [values[i] for i in keep])
+			else:
+				values = [values[i] for i in keep]
+			self.Diagnose('missing-pair-glyphs', feature, sorted(missing), pairs = len(adjustments) - len(keep))
+		else:
+			lefts = list(lefts)
+			rights = list(rights)
+
+		if lefts:
+			self.RegisterLookup(GPOSPairBlock(feature, lefts, rights, values, script, language, lookupflag, comment))
+		return len(lefts)
+
+
+	## Optimization
+
+	def RemoveDuplicateLookups(self):
+		'''
+		Remove lookups whose statement is identical to an earlier lookup of the same feature/script/language/lookupflag,
+		comments disregarded. Pairs within GPOSPairBlocks are included. Also detects single substitutions that
+		substitute the same source glyph with different targets; these are kept, but reported as warnings.
+		Returns dictionary {'removed': n, 'conflicts': [(feature, script, language, lookupflag, source, [targets])]}
+		'''
+		seen = set()
+		singletargets = {}
+		conflicts = OrderedDict()
+		lookups = []
+		removed = 0
+
+		for lookup in self.lookups:
+			context = (lookup.feature, lookup.script, lookup.language, lookup.lookupflag)
+
+			if isinstance(lookup, GPOSPairBlock):
+				keep = []
+				for i in range(len(lookup)):
+					key = context + LookupStatement(lookup, i)
+					if key in seen:
+						removed += 1
+					else:
+						seen.add(key)
+						keep.append(i)
+				if len(keep) < len(lookup):
+					if not keep:
+						continue
+					lookup = SliceGPOSPairBlock(lookup, keep)
+				lookups.append(lookup)
+				continue
+
+			key = context + LookupStatement(lookup)
+			if key in seen:
+				removed += 1
+				continue
+			seen.add(key)
+			lookups.append(lookup)
+
+			# Conflicting single substitutions
+			if isinstance(lookup, GSUBLookup) and IsSingleGlyph(lookup.source) and IsSingleGlyph(lookup.target):
+				sourcekey = context + (lookup.source,)
+				if not sourcekey in singletargets:
+					singletargets[sourcekey] = lookup.target
+				else:
+					if not sourcekey in conflicts:
+						conflicts[sourcekey] = [singletargets[sourcekey]]
+					conflicts[sourcekey].append(lookup.target)
+
+		if removed:
+			self.lookups = lookups
+			self.ReindexLookups()
+			self.Diagnose('removed-duplicates', removed = removed)
+
+		for sourcekey in conflicts:
+			self.Diagnose('conflicting-substitutions', sourcekey[0], [sourcekey[4]], script = sourcekey[1], language = sourcekey[2], lookupflag = sourcekey[3], source = sourcekey[4], targets = conflicts[sourcekey])
+
+		return {'removed': removed, 'conflicts': [sourcekey + (conflicts[sourcekey],) for sourcekey in conflicts]}
+
+
+	def CompactPairPositioning(self, features = None):
+		'''
+		Replace glyph-to-glyph pair positionings by class kerning. Per feature/script/language/lookupflag,
+		left glyphs with identical kerning rows are clustered into @<feature>_L_<n> classes, and right glyphs with
+		identical columns into @<feature>_R_<n> classes. Class pairs are put out as "pos @L @R", pairs of a class and
+		a single glyph as "enum pos", pairs of single glyphs as "pos". The clustering is exact, so the resulting
+		pairs are identical to the original ones; where a pair is defined twice, the first one is kept, as in the AFDKO.
+		Groups that contain other lookups than glyph-to-glyph pair positionings are left untouched.
+		Comments of the replaced lookups are dropped.
+		"features" optionally restricts compaction to these features.
+		Returns report dictionary with line counts and estimated GPOS subtable sizes before and after.
+		'''
+
+		report = {'groups': 0, 'skipped': [], 'classes': 0, 'linesbefore': 0, 'linesafter': 0, 'bytesbefore': 0, 'bytesafter': 0}
+
+		# Collect lookups per feature/script/language/lookupflag
+		groups = OrderedDict()
+		for lookup in self.lookups:
+			if (features is None or lookup.feature in features) and (isinstance(lookup, GPOSLookupType2) or isinstance(lookup, GPOSPairBlock)):
+				groups.setdefault((lookup.feature, lookup.script, lookup.language, lookup.lookupflag), []).append(lookup)
+
+		replacements = {} # id of first lookup of group -> new lookups
+		removals = set() # ids of other lookups of compacted groups
+		classcounters = {}
+
+		for context, lookups in groups.items():
+			feature, script, language, lookupflag = context
+
+			# All lookups of the group must be glyph-to-glyph pairs, otherwise ordering and precedence would change
+			if len(self.lookupindex[feature][script][language][lookupflag]) != len(lookups) or not all([IsGlyphPairLookup(lookup) for lookup in lookups]):
+				report['skipped'].append(context)
+				continue
+
+			pairs = OrderedDict()
+			lines = 0
+			for lookup in lookups:
+				for left, right, adjustment in PairLookupPairs(lookup):
+					lines += 1
+					if not (left, right) in pairs:
+						pairs[(left, right)] = adjustment
+
+			leftclasses, rightclasses, classpairs = ClusterPairs(pairs)
+
+			# Name classes
+			leftnames = []
+			for glyphs in leftclasses:
+				leftnames.append(self.CompactionClassName(feature, 'L', glyphs, classcounters))
+			rightnames = []
+			for glyphs in rightclasses:
+				rightnames.append(self.CompactionClassName(feature, 'R', glyphs, classcounters))
+
+			newlookups = []
+			glyphpairs = 0
+			for leftindex, rightindex, adjustment in classpairs:
+				leftclass = len(leftclasses[leftindex]) > 1
+				rightclass = len(rightclasses[rightindex]) > 1
+				enum = leftclass != rightclass
+				if not leftclass or not rightclass:
+					glyphpairs += len(leftclasses[leftindex]) * len(rightclasses[rightindex])
+				newlookups.append(GPOSLookupType2(feature, '%s %s' % (leftnames[leftindex], rightnames[rightindex]), adjustment, script, language, lookupflag, '', enum))
+
+			# Verify
+			expanded = {}
+			for leftindex, rightindex, adjustment in classpairs:
+				for left in leftclasses[leftindex]:
+					for right in rightclasses[rightindex]:
+						expanded[(left, right)] = adjustment
+			if expanded != dict(pairs):
+				self.Diagnose('compaction-failed', feature)
+				continue
+
+			for glyphs, name in zip(leftclasses + rightclasses, leftnames + rightnames):
+				if len(glyphs) > 1:
+					self.AddGlyphsToClass(name, glyphs)
+					report['classes'] += 1
+
+			replacements[id(lookups[0])] = newlookups
+			for lookup in lookups[1:]:
+				removals.add(id(lookup))
+
+			simple = all([adjustment[1] == 0 and adjustment[2] == 0 and adjustment[3] == 0 for adjustment in pairs.values()])
+			classleft = [glyphs for glyphs in leftclasses if len(glyphs) > 1]
+			classright = set([rightindex for leftindex, rightindex, adjustment in classpairs if len(leftclasses[leftindex]) > 1 and len(rightclasses[rightindex]) > 1])
+			report['groups'] += 1
+			report['linesbefore'] += lines
+			report['linesafter'] += len(newlookups)
+			report['bytesbefore'] += EstimatePairPosFormat1Size(len(set([left for left, right in pairs])), len(pairs), simple)
+			report['bytesafter'] += EstimatePairPosFormat1Size(len(leftclasses) - len(classleft), glyphpairs, simple) + EstimatePairPosFormat2Size(sum([len(glyphs) for glyphs in classleft]), len(classleft), sum([len(rightclasses[i]) for i in classright]), len(classright), simple)
+
+		if replacements:
+			lookups = []
+			for lookup in self.lookups:
+				if id(lookup) in replacements:
+					lookups.extend(replacements[id(lookup)])
+				elif not id(lookup) in removals:
+					lookups.append(lookup)
+			self.lookups = lookups
+			self.ReindexLookups()
+
+		return report
+
+
+	def CoalesceSingleSubstitutions(self, features = None, minimum = 2):
+		'''
+		Combine consecutive one-to-one substitutions of the same feature/script/language/lookupflag
+		into one class-to-class substitution "sub @<feature>_single_<n>_source by @<feature>_single_<n>_target".
+		Rules are only combined while their sources and targets are unique: a substitution whose source was already
+		substituted earlier in the same feature/script/language/lookupflag is kept as it is, as is everything that is
+		not a single glyph substitution (contextual rules, ligatures, existing class rules), and the order of rules is kept.
+		Runs shorter than "minimum" are left alone. Comments of combined rules are dropped.
+		"features" optionally restricts coalescing to these features.
+		Returns report dictionary {'runs': n, 'rulesbefore': n, 'rulesafter': n}.
+		'''
+
+		report = {'runs': 0, 'rulesbefore': 0, 'rulesafter': 0}
+		runs = {} # context -> current run of lookups
+		runtargets = {} # context -> set of target glyphs of the current run
+		seensources = {} # context -> set of source glyphs substituted so far
+		replacements = {}
+		removals = set()
+		classcounters = {}
+
+		def Flush(context):
+			run = runs.pop(context, [])
+			runtargets.pop(context, None)
+			if len(run) < minimum:
+				return
+			feature, script, language, lookupflag = context
+			classcounters[feature] = classcounters.get(feature, 0) + 1
+			while '@%s_single_%s_source' % (feature, classcounters[feature]) in self.classes or '@%s_single_%s_target' % (feature, classcounters[feature]) in self.classes:
+				classcounters[feature] += 1
+			sourceclass = '@%s_single_%s_source' % (feature, classcounters[feature])
+			targetclass = '@%s_single_%s_target' % (feature, classcounters[feature])
+			self.AddGlyphsToClass(sourceclass, [lookup.source for lookup in run])
+			self.AddGlyphsToClass(targetclass, [lookup.target for lookup in run])
+			replacements[id(run[0])] = GSUBLookup(feature, sourceclass, targetclass, script, language, lookupflag, '')
+			for lookup in run[1:]:
+				removals.add(id(lookup))
+			report['runs'] += 1
+			report['rulesbefore'] += len(run)
+			report['rulesafter'] += 1
+
+		for lookup in self.lookups:
+			if features is not None and not lookup.feature in features:
+				continue
+			context = (lookup.feature, lookup.script, lookup.language, lookup.lookupflag)
+			sources = seensources.setdefault(context, set())
+
+			if isinstance(lookup, GSUBLookup) and IsSingleGlyph(lookup.source) and IsSingleGlyph(lookup.target):
+				if lookup.source in sources:
+					# Repeated source: keep this rule as it is
+					Flush(context)
+					continue
+				if lookup.target in runtargets.get(context, ()):
+					# Repeated target: classes can't hold a glyph twice, start a new run
+					Flush(context)
+				sources.add(lookup.source)
+				runs.setdefault(context, []).append(lookup)
+				runtargets.setdefault(context, set()).add(lookup.target)
+			else:
+				if isinstance(lookup, GSUBLookup):
+					# Class and context rules may substitute glyphs of later single substitutions
+					for glyph in self.DeflateClassString(lookup.source):
+						sources.add(glyph)
+				Flush(context)
+
+		for context in list(runs.keys()):
+			Flush(context)
+
+		if replacements:
+			lookups = []
+			for lookup in self.lookups:
+				if id(lookup) in replacements:
+					lookups.append(replacements[id(lookup)])
+				elif not id(lookup) in removals:
+					lookups.append(lookup)
+			self.lookups = lookups
+			self.ReindexLookups()
+
+		return report
+
+
+	def CompactionClassName(self, feature, side, glyphs, classcounters):
+		'''
+		Returns a new, unused class name like @kern_L_1 for a cluster of several glyphs, or the glyph name itself for a single glyph.
+		'''
+		if len(glyphs) == 1:
+			return glyphs[0]
+		while True:
+			classcounters[(feature, side)] = classcounters.get((feature, side), 0) + 1
+			classname = '@%s_%s_%s' % (feature, side, classcounters[(feature, side)])
+			if not classname in self.classes:
+				return classname
 
 
 	## Classes
 
 	def AddGlyphsToClass(self, classname, glyphnames):
-		# init dict
-		
-#		if classname == '@ordn_source' and glyphnames == 'n':
-#			print 'jetzt'
+		'''
+		Add glyphs to a class, creating it if necessary. Glyphs missing in the glyph repertoire are left out.
+		Glyphs already in the class are not added again, but counted in ClassDuplicates() and reported as diagnostic "duplicate-class-glyphs".
+		'''
 		
 		if not classname.startswith('@'):
 			classname = '@' + classname
-		if not self.classes.has_key(classname):
-#		if self.HasGlyphs(glyphnames) and not self.classes.has_key(classname):
-			self.classes[classname] = []
-
+		if not classname in self.classes:
+			self.classes[classname] = GlyphClass()
+		self.ClassChanged(classname)
 
+		glyphclass = self.classes[classname]
+		duplicates = []
 		if isinstance(glyphnames, str):
-			if self.HasGlyphs([glyphnames]):
-				self.classes[classname].append(glyphnames)
+			if glyphnames in self.repertoire:
+				if not glyphclass.Add(glyphnames):
+					duplicates.append(glyphnames)
 		elif isinstance(glyphnames, tuple) or isinstance(glyphnames, list):
 			for glyphname in glyphnames:
-				if self.HasGlyphs([glyphname]):
-					self.classes[classname].append(glyphname)
+				if glyphname in self.repertoire:
+					if not glyphclass.Add(glyphname):
+						duplicates.append(glyphname)
+		if duplicates:
+			self.Diagnose('duplicate-class-glyphs', None, duplicates, classname = classname)
+
+
+	def AddClassFromClasses(self, classname, operation, classnames):
+		'''
+		Create or replace a class as the union, intersection or difference of existing classes, in the order of the first class.
+		"operation" is 'union', 'intersection' or 'difference'. Classes are combined directly, without expanding them to glyph names again.
+		'''
+		if not classname.startswith('@'):
+			classname = '@' + classname
+		classnames = [name if name.startswith('@') else '@' + name for name in classnames]
+
+		missing = [name for name in classnames if not name in self.classes]
+		if missing:
+			self.Diagnose('undefined-classes', classname = classname, operation = operation, missing = missing)
+
+		result = None
+		for name in classnames:
+			glyphclass = self.classes.get(name, GlyphClass())
+			if result is None:
+				result = glyphclass.Copy()
+			elif operation == 'union':
+				result = result.Union(glyphclass)
+			elif operation == 'intersection':
+				result = result.Intersection(glyphclass)
+			elif operation == 'difference':
+				result = result.Difference(glyphclass)
+			else:
+				self.Diagnose('unknown-class-operation', operation = operation)
+				return
+		if result is None:
+			result = GlyphClass()
+		result.duplicates = 0
+
+		self.classes[classname] = result
+		self.ClassChanged(classname)
+
+
+	def ClassChanged(self, classname):
+		'''
+		Mark a class as changed for ChangedClasses(), ClassesDigest() and the DeflateClassString() cache.
+		With subtable breaks, features with pair positionings are marked as changed too, as class sizes decide where the breaks go.
+		'''
+		self.dirtyclasses.add(classname)
+		self.classdigests.pop(classname, None)
+		if self.subtablesize:
+			self.dirtyfeatures.update(self.pairfeatures)
+
+		# Cached deflated strings referencing this class are outdated now
+		for string in self.deflatecachereferences.pop(classname, ()):
+			if string in self.deflatecache:
+				del self.deflatecache[string]
+
+
+	def ClassDuplicates(self):
+		'''
+		Returns dictionary of classname -> number of glyphs that were attempted to be added to the class a second time.
+		'''
+		duplicates = {}
+		for classname in self.classes.keys():
+			if self.classes[classname].duplicates:
+				duplicates[classname] = self.classes[classname].duplicates
+		return duplicates
 
 
 	def AddEndingToBothClasses(self, feature, ending):
-		if ending in self.Groups():
+		if ending in self.glyphgroups:
+			sourceclass = self.classes.get('@' + feature + '_source')
+			duplicates = []
 			for glyph in self.GlyphsInGroup(ending):
-				if self.HasGlyphs([glyph, self.SourceGlyphFromTarget(glyph)]):
-					self.AddGlyphsToClass(feature + '_source', [self.SourceGlyphFromTarget(glyph)] )
+				source = self.glyphgroups.SourceGlyph(glyph, ending)
+				if source in self.repertoire: # glyph is present, as it comes from the groups
+					# Keep source and target classes aligned: a source glyph can only be substituted once
+					if sourceclass is not None and source in sourceclass:
+						sourceclass.duplicates += 1
+						duplicates.append(source)
+						continue
+					self.AddGlyphsToClass(feature + '_source', [source] )
 					self.AddGlyphsToClass(feature + '_target', [glyph])
+					sourceclass = self.classes['@' + feature + '_source']
+			if duplicates:
+				self.Diagnose('duplicate-class-glyphs', feature, duplicates, classname = '@' + feature + '_source')
 
 	def DuplicateFeature(self, source, target):
 		
 		# Check, if target feature is already in use
 		if target in self.UsedFeatures():
-			self.Warning("Duplicate feature '" + source + "' as '" + target + "'. The target feature '" + target + "' already contains some lookups. I appended the instructions of '" + source + "' to '" + target + "', but they should be completely separate.")
+			self.Diagnose('duplicate-feature-in-use', target, source = source)
 
 		newlookups = []
 		for lookup in self.lookups:
@@ -441,33 +1088,27 @@ class DancingShoes:
 				newlookup = copy.copy(lookup)
 				newlookup.feature = target
 				newlookups.append(newlookup)
-		self.lookups.extend(newlookups)
+		for newlookup in newlookups:
+			self.RegisterLookup(newlookup)
 		
 				
 
 	# NEW in 1.0.3, not yet documented
 	def GlyphsInClass(self, classname):
-		if self.classes.has_key(classname):
-			return self.classes[classname]
+		if classname in self.classes:
+			return self.classes[classname].Glyphs()
 		else:
 			return None
 
 
 	# NEW in 1.0.3, not yet documented
 	def ClassHasGlyphs(self, classname, glyphnames):
-		if self.classes.has_key(classname):
+		if classname in self.classes:
 			if isinstance(glyphnames, str):
-				if glyphnames in self.GlyphsInClass(classname):
+				if glyphnames in self.classes[classname]:
 					return True
 			elif isinstance(glyphnames, tuple) or isinstance(glyphnames, list):
-				present = 0
-				for glyph in glyphnames:
-					if glyph in self.GlyphsInClass(classname):
-						present += 1
-				if present == len(glyphnames):
-					return True
-				else:
-					return False
+				return self.classes[classname].HasGlyphs(glyphnames)
 		else:
 			return False
 		
@@ -476,24 +1117,82 @@ class DancingShoes:
 		'''
 		Deflate string containing glyph names, groups or class names into a flat group of glyph names.
 		[@fractionslashes @dnom_target] @numr_target'
+		Results are kept in an LRU cache that is invalidated when a referenced class is changed through AddGlyphsToClass().
+		The returned list is shared with the cache and must not be modified.
 		'''
+		cached = self.deflatecache.get(string)
+		if cached is not None:
+			self.deflatecachehits += 1
+			# Move to the end of the LRU order
+			del self.deflatecache[string]
+			self.deflatecache[string] = cached
+			return cached[0]
+
+		self.deflatecachemisses += 1
 		list = []
-		string = string.replace("'", "")
-		string = string.replace("[", "")
-		string = string.replace("]", "")
-		
-		tokens = string.split(' ')
-		
-		for token in tokens:
+		classnames = []
+		for token in ClassStringTokens(string):
 			if token.startswith('@'): # is class, add members of class
-				classname = token[1:]
-				if self.classes.has_key(classname):
-					list.extend(self.classes[classname])
+				classnames.append(token)
+				if token in self.classes:
+					list.extend(self.classes[token])
 			else:
 				list.append(token)
+
+		self.deflatecache[string] = (list, classnames)
+		for classname in classnames:
+			self.deflatecachereferences.setdefault(classname, set()).add(string)
+
+		# Evict least recently used entries
+		while len(self.deflatecache) > self.deflatecachesize:
+			oldstring, (oldlist, oldclassnames) = self.deflatecache.popitem(last = False)
+			for classname in oldclassnames:
+				if classname in self.deflatecachereferences:
+					self.deflatecachereferences[classname].discard(oldstring)
+
 		return list
 
 
+	def DeflateCacheStatistics(self):
+		'''
+		Returns dictionary with hit and miss counts and current size of the DeflateClassString() cache.
+		'''
+		return {'hits': self.deflatecachehits, 'misses': self.deflatecachemisses, 'size': len(self.deflatecache)}
+
+
+	## Snapshot
+
+	def Freeze(self):
+		'''
+		Returns an immutable snapshot of this object as FrozenDancingShoes.
+		Lookups and classes of the snapshot are not affected by later changes to this object, and vice versa.
+		'''
+		frozen = copy.copy(self)
+		frozen.__class__ = FrozenDancingShoes
+		frozen.features = tuple(self.features)
+		frozen.lookups = tuple(self.lookups)
+		frozen.classes = FrozenClasses([(classname, self.classes[classname].FrozenCopy()) for classname in self.classes.keys()])
+		frozen.deflatecache = OrderedDict()
+		frozen.deflatecachereferences = {}
+		frozen.dirtyfeatures = set(self.dirtyfeatures)
+		frozen.dirtyclasses = set(self.dirtyclasses)
+		frozen.featurecontentcache = dict(self.featurecontentcache)
+		frozen.deliveredfeatures = dict(self.deliveredfeatures)
+		frozen.deliveredclasses = dict(self.deliveredclasses)
+		frozen.classdigests = dict(self.classdigests)
+		frozen.infos = list(self.infos)
+		frozen.warnings = list(self.warnings)
+		frozen.errors = list(self.errors)
+		frozen.diagnosticcounts = dict(self.diagnosticcounts)
+		if self.profiler is not None:
+			# Method wrappers belong to this object
+			for name in self.profiler.wrapped:
+				frozen.__dict__.pop(name, None)
+			frozen.profiler = None
+		frozen.IndexLookups()
+		return frozen
+
+
 	## Generate Feature Code
 
 	def GetFDKCode(self, codeversion = None):
@@ -503,31 +1202,48 @@ class DancingShoes:
 		FDK2.3
 		FDK2.5
 		'''
+		return ''.join(self.IterFDKCode(codeversion))
+
+
+	def WriteFDKCode(self, fileobj, codeversion = None):
+		'''
+		Write feature code to a writable text stream, such as an open file.
+		The code is streamed feature by feature and never held in memory as a whole.
+		Available codeversions so far:
+		FDK2.3
+		FDK2.5
+		'''
+		buffer = []
+		for chunk in self.IterFDKCode(codeversion):
+			buffer.append(chunk)
+			if len(buffer) >= 1024:
+				fileobj.write(''.join(buffer))
+				buffer = []
+		if buffer:
+			fileobj.write(''.join(buffer))
+
+
+	def IterFDKCode(self, codeversion = None):
+		'''
+		Generator yielding the feature code of GetFDKCode() in consecutive chunks.
+		'''
 
 		codeversion = GetFDKCodeVersion(codeversion)
-		featurecode = []
-	
-		if codeversion == '2.3':
-			defaultscript = 'dflt'
-			defaultlanguage = 'dflt'
-		elif codeversion == '2.5':
-			defaultscript = 'DFLT'
-			defaultlanguage = 'dflt'
-	
-		# Language System
-		featurecode.append(self.GetFDKLanguageSystemCode(codeversion))
 
+		# Language System
+		for chunk in self.ProfilePhase('languagesystem', self.IterFDKLanguageSystemCode(codeversion)):
+			yield chunk
+		yield '\n'
 
 		# Classes
-		featurecode.append(self.GetFDKClassesCode(codeversion))
-
+		for chunk in self.ProfilePhase('classes', self.IterFDKClassesCode(codeversion)):
+			yield chunk
 
 		# Run through Features
 		for feature in self.UsedFeatures():
-			featurecode.append(self.GetFDKFeatureCode(feature, codeversion))
-
-
-		return '\n'.join(featurecode)
+			yield '\n'
+			for chunk in self.ProfilePhase('feature %s' % (feature), self.IterFDKFeatureCode(feature, codeversion)):
+				yield chunk
 
 
 	def GetFDKFeatureCode(self, feature, codeversion = None):
@@ -537,18 +1253,20 @@ class DancingShoes:
 		FDK2.3
 		FDK2.5
 		'''
+		return ''.join(self.IterFDKFeatureCode(feature, codeversion))
 
-		featurecode = []
-	
-		featurecode.append('feature %s {' % (feature))
 
-		featurecode.append(self.GetFDKFeatureContent(feature, codeversion))
+	def IterFDKFeatureCode(self, feature, codeversion = None):
+		'''
+		Generator yielding the code of GetFDKFeatureCode() in consecutive chunks.
+		'''
+
+		yield 'feature %s {\n' % (feature)
 
-		featurecode.append('')
-		featurecode.append('} %s;' % (feature))
-		featurecode.append('')
+		for chunk in JoinLines(self.IterFDKFeatureContentLines(feature, codeversion)):
+			yield chunk
 
-		return '\n'.join(featurecode)
+		yield '\n\n} %s;\n' % (feature)
 
 
 	def GetFDKFeatureContent(self, feature, codeversion = None):
@@ -558,20 +1276,77 @@ class DancingShoes:
 		FDK2.3
 		FDK2.5
 		'''
+		codeversion = GetFDKCodeVersion(codeversion)
+
+		# Reuse the last generated text if the feature's lookups and the output settings are unchanged.
+		# Texts are only kept with cachefeaturecontents switched on, so that one-off code generation doesn't hold on to them.
+		settings = (codeversion, self.subtablesize, self.namecomments)
+		if not feature in self.dirtyfeatures:
+			cached = self.featurecontentcache.get(feature)
+			if cached is not None and cached[0] == settings:
+				return cached[1]
+
+		text = '\n'.join(self.IterFDKFeatureContentLines(feature, codeversion))
+		if self.cachefeaturecontents:
+			self.featurecontentcache[feature] = (settings, text)
+			self.dirtyfeatures.discard(feature)
+		return text
+
+
+	def ChangedFeatureContents(self, codeversion = None):
+		'''
+		Returns ordered dictionary of feature -> GetFDKFeatureContent() for all features whose code changed
+		since the last call, in the order of the features list. Features that are no longer in use are returned with None.
+		Switches on cachefeaturecontents, so unchanged features are not generated again on the next call.
+		'''
+		self.cachefeaturecontents = True
+		changed = OrderedDict()
+		usedfeatures = self.UsedFeatures()
+		for feature in usedfeatures:
+			text = self.GetFDKFeatureContent(feature, codeversion)
+			if self.deliveredfeatures.get(feature) != text:
+				changed[feature] = text
+				self.deliveredfeatures[feature] = text
+		for feature in list(self.deliveredfeatures.keys()):
+			if not feature in usedfeatures:
+				changed[feature] = None
+				del self.deliveredfeatures[feature]
+		return changed
+
+
+	def ChangedClasses(self):
+		'''
+		Returns ordered dictionary of classname -> space-delimited glyph names for all classes that changed
+		since the last call, sorted by class name.
+		'''
+		changed = OrderedDict()
+		for classname in sorted(self.dirtyclasses):
+			code = ' '.join(self.classes[classname])
+			if self.deliveredclasses.get(classname) != code:
+				changed[classname] = code
+				self.deliveredclasses[classname] = code
+		self.dirtyclasses = set()
+		return changed
+
+
+	def IterFDKFeatureContentLines(self, feature, codeversion = None, lookuplines = None):
+		'''
+		Generator yielding the lines of GetFDKFeatureContent().
+		"lookuplines" optionally replaces FDKLookupLines() for putting out the lookups of one feature/script/language/lookupflag.
+		'''
+
+		if lookuplines is None:
+			lookuplines = self.FDKLookupLines
 
 		codeversion = GetFDKCodeVersion(codeversion)
-		featurecode = []
-	
-		if codeversion == '2.3':
-			defaultscript = 'dflt'
-			defaultlanguage = 'dflt'
-		elif codeversion == '2.5':
-			defaultscript = 'DFLT'
-			defaultlanguage = 'dflt'
+		settings = FDKCodeVersionSettings(codeversion)
+		defaultscript = settings.defaultscript
+		defaultlanguage = settings.defaultlanguage
 
 
-		featurecode.append('# %s' % (opentypenames.OTfeatures[feature]))
-		featurecode.append('')
+		if self.namecomments:
+			yield '# %s' % (OpenTypeNames().OTfeatures[feature])
+			yield ''
 
 		# Default lookups
 		
@@ -580,36 +1355,37 @@ class DancingShoes:
 		usedlookupflags = self.UsedLookUpFlags(feature, '__DEFAULT__', '__DEFAULT__')
 
 		# lookup has more than one script
-		# put out dflt/dflt looklups directly here without script/language tags, if FDK version is 2.5
-		if (codeversion == "2.3" and len(usedscripts) == 1 and usedscripts[0] == '__DEFAULT__' and len(usedlanguages) == 1 and usedlanguages[0] == '__DEFAULT__' and len(usedlookupflags) == 1 and usedlookupflags[0] == '__DEFAULT__') or codeversion != "2.3":
-			featurecode.extend(FDKlookupcode(self.UsedLookups(feature, '__DEFAULT__', '__DEFAULT__', '__DEFAULT__'), 1))
-			featurecode.append('')
+		# put out dflt/dflt looklups directly here without script/language tags, if the code version inlines default lookups (FDK 2.5)
+		if settings.inlinedefaultlookups or (len(usedscripts) == 1 and usedscripts[0] == '__DEFAULT__' and len(usedlanguages) == 1 and usedlanguages[0] == '__DEFAULT__' and len(usedlookupflags) == 1 and usedlookupflags[0] == '__DEFAULT__'):
+			for line in lookuplines(feature, '__DEFAULT__', '__DEFAULT__', '__DEFAULT__', 1):
+				yield line
+			yield ''
 
 
 		# put out all other scripts/languages, including dflt/dflt for 2.3	
 		if ((len(usedscripts) == 1 and usedscripts[0] != '__DEFAULT__') or (len(usedlanguages) == 1 and usedlanguages[0] != '__DEFAULT__') or (len(usedlookupflags) == 1 and usedlookupflags[0] != '__DEFAULT__')) or (len(usedscripts) > 1 or len(usedlanguages) > 1 or len(usedlookupflags) > 1):
 
 			# Script
-			if codeversion == "2.3":
-				usedscripts = self.UsedScripts(feature)
-				usedscripts.sort(ScriptSort)
-				lookupflagjoiner = ', '
-			else:
+			if settings.inlinedefaultlookups:
 				usedscripts = self.UsedScripts(feature, False, True)
-				usedscripts.sort(ScriptSort)
-				lookupflagjoiner = ' '
+			else:
+				usedscripts = self.UsedScripts(feature)
+			usedscripts.sort(ScriptSort)
+			lookupflagjoiner = settings.lookupflagjoiner
 			
 			for script in usedscripts:
-				featurecode.append('  # %s' % (opentypenames.OTscripts[TranslateScript(script, defaultscript)]))
-				featurecode.append('  script %s;' % (TranslateScript(script, defaultscript)))
+				if self.namecomments:
+					yield '  # %s' % (OpenTypeNames().OTscripts[TranslateScript(script, defaultscript)])
+				yield '  script %s;' % (TranslateScript(script, defaultscript))
 	
 				# Language
 				usedlanguages = self.UsedLanguages(feature, script)
 				usedlanguages.sort(LanguageSort)
 
 				for language in usedlanguages:
-					featurecode.append('    # %s' % (opentypenames.OTlanguages[TranslateLanguage(language, defaultlanguage)]))
-					featurecode.append('    language %s;' % (TranslateLanguage(language, defaultlanguage)))
+					if self.namecomments:
+						yield '    # %s' % (OpenTypeNames().OTlanguages[TranslateLanguage(language, defaultlanguage)])
+					yield '    language %s;' % (TranslateLanguage(language, defaultlanguage))
 	
 					# Lookups
 					lookupflags = self.UsedLookUpFlags(feature, script, language)
@@ -617,172 +1393,1185 @@ class DancingShoes:
 					
 					if len(lookupflags) == 1:
 						if lookupflags[0] != '__DEFAULT__':
-							featurecode.append('      lookupflag %s;' % (lookupflagjoiner.join(lookupflags[0].split(','))))
-						featurecode.extend(FDKlookupcode(self.UsedLookups(feature, script, language, lookupflags[0]), 3))
+							yield '      lookupflag %s;' % (lookupflagjoiner.join(lookupflags[0].split(',')))
+						for line in lookuplines(feature, script, language, lookupflags[0], 3):
+							yield line
 					else:
 						for i, lookupflag in enumerate(lookupflags):
-							featurecode.append('')
-							featurecode.append('      lookup %s_%s {' % (feature, i))
+							yield ''
+							yield '      lookup %s_%s {' % (feature, i)
 							if lookupflag != '__DEFAULT__':
-								featurecode.append('        lookupflag %s;' % (lookupflagjoiner.join(lookupflag.split(','))))
-							featurecode.extend(FDKlookupcode(self.UsedLookups(feature, script, language, lookupflag), 4))
-							featurecode.append('      } %s_%s;' % (feature, i))
-				featurecode.append('')
+								yield '        lookupflag %s;' % (lookupflagjoiner.join(lookupflag.split(',')))
+							for line in lookuplines(feature, script, language, lookupflag, 4):
+								yield line
+							yield '      } %s_%s;' % (feature, i)
+				yield ''
 
 
-		return '\n'.join(featurecode)
+	def FDKLookupLines(self, feature, script, language, lookupflag, intendlevel):
+		'''
+		Generator yielding the code lines of all lookups of given feature and script and language and lookupflag.
+		Class pair positionings are grouped by their left side and broken into subtables of about self.subtablesize estimated bytes.
+		'''
+		lookups, estimate = self.SubtableLookups(self.lookupindex.get(feature, {}).get(script, {}).get(language, {}).get(lookupflag, []))
+		return FDKlookuplines(lookups, intendlevel, estimate)
+
+
+	def SubtableLookups(self, lookups):
+		'''
+		Returns (lookups, estimate) for putting out the lookups of one feature/script/language/lookupflag:
+		the lookups with their class pairs grouped by GroupClassPairs() and a new PairSubtableEstimate for them,
+		or the lookups as they are and None if subtable breaks are switched off.
+		'''
+		if self.subtablesize:
+			lookups, groups = GroupClassPairs(lookups)
+			return lookups, PairSubtableEstimate(self.subtablesize, self.classes, groups)
+		return lookups, None
 
 
 	def GetFDKClassesCode(self, codeversion = None):
 		'''
 		Return classes code all in one string.
 		'''
+		return ''.join(self.IterFDKClassesCode(codeversion))
+
+
+	def IterFDKClassesCode(self, codeversion = None):
+		'''
+		Generator yielding the code of GetFDKClassesCode() in consecutive chunks.
+		'''
 
 		codeversion = GetFDKCodeVersion(codeversion)
-		featurecode = []
-		
-		if codeversion == '2.3':
-			defaultscript = 'dflt'
-			defaultlanguage = 'dflt'
-		elif codeversion == '2.5':
-			defaultscript = 'DFLT'
-			defaultlanguage = 'dflt'
-	
+
+		for chunk in JoinLines(self.IterFDKClassesLines(codeversion)):
+			yield chunk
+		yield '\n\n'
+
+
+	def IterFDKClassesLines(self, codeversion):
 
 		# Classes
 
 		classes = self.classes.keys()
 		classes.sort()
 		for classname in classes:
+			glyphs = self.classes[classname]
 			if not classname.startswith('@'):
 				classname = '@' + classname
-			featurecode.append('%s = [' % (classname))
-			featurecode.append('# ' + str(len(self.classes[classname])) + ' glyph(s)')
-			featurecode.append(' '.join(self.classes[classname]))
-			featurecode.append('];')
-			featurecode.append('')
+			yield '%s = [' % (classname)
+			yield '# ' + str(len(glyphs)) + ' glyph(s)'
+			yield ' '.join(glyphs)
+			yield '];'
+			yield ''
 
 
-		featurecode.append('')
-		return '\n'.join(featurecode) + '\n\n'
+		yield ''
 
 
 	def GetFDKLanguageSystemCode(self, codeversion = None):
 		'''
 		Return language system code all in one string.
 		'''
+		return ''.join(self.IterFDKLanguageSystemCode(codeversion))
+
+
+	def IterFDKLanguageSystemCode(self, codeversion = None):
+		'''
+		Generator yielding the code of GetFDKLanguageSystemCode() in consecutive chunks.
+		'''
 
 		codeversion = GetFDKCodeVersion(codeversion)
-		featurecode = []
+
+		for chunk in JoinLines(self.IterFDKLanguageSystemLines(codeversion)):
+			yield chunk
+		yield '\n\n'
+
+
+	def IterFDKLanguageSystemLines(self, codeversion):
 		
-		if codeversion == '2.3':
-			defaultscript = 'dflt'
-			defaultlanguage = 'dflt'
-		elif codeversion == '2.5':
-			defaultscript = 'DFLT'
-			defaultlanguage = 'dflt'
+		settings = FDKCodeVersionSettings(codeversion)
+		defaultscript = settings.defaultscript
+		defaultlanguage = settings.defaultlanguage
 	
-		featurecode.append('# Dancing Shoes %s OpenType feature code generator by Yanone, Copyright 2009' % (__version__))
-		featurecode.append('# Code generated for AFDKO version %s' % (codeversion))
-		featurecode.append('')
-		featurecode.append('')
+		yield '# Dancing Shoes %s OpenType feature code generator by Yanone, Copyright 2009' % (__version__)
+		yield '# Code generated for AFDKO version %s' % (codeversion)
+		yield ''
+		yield ''
 
 		# Script, language systems		
 		for script, language in self.UsedScriptsAndLanguages():
-			featurecode.append('languagesystem %s %s; # %s, %s' % (TranslateScript(script, defaultscript), TranslateLanguage(language, defaultlanguage), opentypenames.OTscripts[TranslateScript(script, defaultscript)], opentypenames.OTlanguages[TranslateLanguage(language, defaultlanguage)]))
+			if self.namecomments:
+				yield 'languagesystem %s %s; # %s, %s' % (TranslateScript(script, defaultscript), TranslateLanguage(language, defaultlanguage), OpenTypeNames().OTscripts[TranslateScript(script, defaultscript)], OpenTypeNames().OTlanguages[TranslateLanguage(language, defaultlanguage)])
+			else:
+				yield 'languagesystem %s %s;' % (TranslateScript(script, defaultscript), TranslateLanguage(language, defaultlanguage))
 
-		featurecode.append('')
-		featurecode.append('')
+		yield ''
+		yield ''
 
-		featurecode.append('')
-		return '\n'.join(featurecode) + '\n\n'
+		yield ''
 
 
 
 	
+class FrozenDancingShoes(DancingShoes):
+	'''
+	Immutable snapshot of a DancingShoes object, as returned by DancingShoes.Freeze().
+	Feature code can be generated, but lookups and classes can't be added, removed or changed: all such methods raise TypeError.
+	'''
+	def Frozen(self, action):
+		raise TypeError('Attempting to %s, but this DancingShoes object is frozen' % (action))
+
+	def RegisterLookup(self, lookup):
+		self.Frozen('add a lookup to feature "%s"' % (lookup.feature))
+
+	def ReindexLookups(self):
+		self.Frozen('reindex lookups')
+
+	def AddFeatureLookup(self, feature, *arguments, **keywords):
+		self.Frozen('add a lookup to feature "%s"' % (feature))
+
+	def AddSimpleSubstitutionFeature(self, feature, *arguments, **keywords):
+		self.Frozen('add a lookup to feature "%s"' % (feature))
+
+	def AddSubstitution(self, feature, *arguments, **keywords):
+		self.Frozen('add a lookup to feature "%s"' % (feature))
+
+	def AddSubstitutions(self, rows):
+		self.Frozen('add substitutions')
+
+	def AddSinglePositioning(self, feature, *arguments, **keywords):
+		self.Frozen('add a lookup to feature "%s"' % (feature))
+
+	def AddPairPositioning(self, feature, *arguments, **keywords):
+		self.Frozen('add a lookup to feature "%s"' % (feature))
+
+	def AddPairPositioningBatch(self, feature, *arguments, **keywords):
+		self.Frozen('add a lookup to feature "%s"' % (feature))
+
+	def RemoveDuplicateLookups(self):
+		self.Frozen('remove duplicate lookups')
+
+	def CompactPairPositioning(self, features = None):
+		self.Frozen('compact pair positioning')
+
+	def CoalesceSingleSubstitutions(self, features = None, minimum = 2):
+		self.Frozen('coalesce single substitutions')
+
+	def AddGlyphsToClass(self, classname, glyphnames):
+		self.Frozen('add glyphs to class "%s"' % (classname))
+
+	def AddClassFromClasses(self, classname, operation, classnames):
+		self.Frozen('add glyphs to class "%s"' % (classname))
+
+	def ClassChanged(self, classname):
+		self.Frozen('change class "%s"' % (classname))
+
+	def AddEndingToBothClasses(self, feature, ending):
+		self.Frozen('add glyphs to the classes of feature "%s"' % (feature))
+
+	def DuplicateFeature(self, source, target):
+		self.Frozen('duplicate feature "%s" as "%s"' % (source, target))
+
+
+
+# Diagnostics
+
+# Severities
+INFO = 1
+WARNING = 2
+ERROR = 3
+
+# DIAGNOSTICS[code] = (severity, message template formatted with the diagnostic's arguments, or function returning the message)
+DIAGNOSTICS = {
+	'info': (INFO, '%(message)s'),
+	'warning': (WARNING, '%(message)s'),
+	'error': (ERROR, '%(message)s'),
+	'unknown-feature': (WARNING, 'Attempting to add %(kind)s to feature "%(feature)s", but the feature is not present in your supplied features list'),
+	'feature-not-in-use': (INFO, 'Attempting to add feature "%(lookupfeature)s" lookup to feature "%(feature)s", but the feature is not in use (yet)'),
+	'missing-group': (INFO, 'Attempting to add simple substitution feature "%(feature)s", but group "%(ending)s" is missing in your glyph repertoire.'),
+	'missing-substitution-glyphs': (INFO, 'Attempting to add substitution glyph sequence to feature "%(feature)s", but glyphs from either the source ("%(source)s") or the target ("%(target)s") are missing in your glyph repertoire.'),
+	'rejected-substitutions': (INFO, lambda arguments: 'Attempting to add %s substitution glyph sequence(s), but glyphs from either the source or the target are missing in your glyph repertoire (%s).' % (arguments['rejected'], ', '.join(['%s: %s' % (feature, arguments['rejectedfeatures'][feature]) for feature in sorted(arguments['rejectedfeatures'].keys())]))),
+	'pair-length-mismatch': (ERROR, 'Attempting to add pair positioning lookups to feature "%(feature)s", but the left glyphs (%(lefts)s), right glyphs (%(rights)s) and adjustments (%(adjustments)s) differ in length'),
+	'missing-pair-glyphs': (INFO, lambda arguments: 'Attempting to add pair positioning lookups to feature "%s", but %s pair(s) contain glyphs that are missing in your glyph repertoire: %s' % (arguments['feature'], arguments['pairs'], ', '.join(arguments['glyphs']))),
+	'removed-duplicates': (INFO, 'Removed %(removed)s duplicate lookup(s).'),
+	'conflicting-substitutions': (WARNING, lambda arguments: 'Conflicting substitutions in feature "%s" (script %s, language %s, lookupflag %s): "%s" is substituted by %s. Only the first one will take effect.' % (arguments['feature'], arguments['script'], arguments['language'], arguments['lookupflag'], arguments['source'], ', '.join(['"%s"' % (target) for target in arguments['targets']]))),
+	'compaction-failed': (ERROR, 'Kerning compaction of feature "%(feature)s" failed verification, leaving it untouched.'),
+	'undefined-classes': (INFO, lambda arguments: 'Attempting to build class "%s" as %s of classes, but class(es) %s are not defined.' % (arguments['classname'], arguments['operation'], ', '.join(arguments['missing']))),
+	'unknown-class-operation': (ERROR, 'Unknown class operation "%(operation)s", use "union", "intersection" or "difference".'),
+	'duplicate-class-glyphs': (INFO, lambda arguments: 'Attempting to add glyph(s) %s to class "%s", but they are in the class already. They are only kept once.' % (', '.join(arguments['glyphs']), arguments['classname'])),
+	'duplicate-feature-in-use': (WARNING, "Duplicate feature '%(source)s' as '%(feature)s'. The target feature '%(feature)s' already contains some lookups. I appended the instructions of '%(source)s' to '%(feature)s', but they should be completely separate."),
+	}
+
+class Diagnostic(object):
+	'''
+	Diagnostic record: code, feature and glyphs concerned, and the arguments to format its message with.
+	The message is only formatted when asked for.
+	'''
+	__slots__ = ('code', 'feature', 'glyphs', 'arguments')
+	def __init__(self, code, feature = None, glyphs = None, arguments = None):
+		self.code = code
+		self.feature = feature
+		self.glyphs = glyphs
+		self.arguments = arguments or {}
+
+	def Severity(self):
+		return DIAGNOSTICS[self.code][0]
+
+	def Message(self):
+		arguments = dict(self.arguments)
+		arguments['feature'] = self.feature
+		arguments['glyphs'] = self.glyphs
+		template = DIAGNOSTICS[self.code][1]
+		if callable(template):
+			return template(arguments)
+		return template % arguments
+
+	def __str__(self):
+		return self.Message()
+
+	def __repr__(self):
+		return 'Diagnostic(%r, %r, %r, %r)' % (self.code, self.feature, self.glyphs, self.arguments)
+
+
+
+# Digests
+
+# Number of lookups per block of the lookup digest, see DancingShoes.LookupsDigest()
+LOOKUPDIGESTBLOCK = 4096
+
+def Digest(text):
+	'''
+	Returns hexadecimal SHA-1 digest of a string.
+	'''
+	if not isinstance(text, bytes):
+		text = text.encode('utf-8')
+	return hashlib.sha1(text).hexdigest()
+
+def LookupDigestLine(lookup):
+	'''
+	Returns one-line string of a lookup's type and contents, for DancingShoes.LookupsDigest().
+	'''
+	if isinstance(lookup, GPOSLookupType2):
+		return '%s\x1f%s\x1f%s\x1f%r\x1f%s\x1f%s\x1f%s\x1f%r\x1f%s' % (lookup.type, lookup.feature, lookup.pair, lookup.adjustment, lookup.script, lookup.language, lookup.lookupflag, lookup.comment, lookup.enum)
+	elif isinstance(lookup, GSUBLookup):
+		return '%s\x1f%s\x1f%s\x1f%s\x1f%s\x1f%s\x1f%s\x1f%r' % (lookup.type, lookup.feature, lookup.source, lookup.target, lookup.script, lookup.language, lookup.lookupflag, lookup.comment)
+	elif isinstance(lookup, GPOSPairBlock):
+		return '%s\x1f%s\x1f%r\x1f%r\x1f%r\x1f%s\x1f%s\x1f%s\x1f%r' % (lookup.type, lookup.feature, lookup.lefts, lookup.rights, list(lookup.adjustments), lookup.script, lookup.language, lookup.lookupflag, lookup.comment)
+	return repr(tuple([lookup.type] + [getattr(lookup, attribute) for attribute in lookup.__slots__]))
+
+
+
+# Profiling
+
+# Methods that are never wrapped by DancingShoes.EnableProfiling()
+PROFILINGEXCLUDEDMETHODS = set(['EnableProfiling', 'DisableProfiling', 'ProfilePhase', 'ProfileReport', 'Profile'])
+
+class Profiler:
+	'''
+	Call counts, cumulative wall time and allocated bytes per method and per emission phase of a DancingShoes object.
+	Times of nested calls are included in the caller's time. Allocated bytes are the net growth of memory traced by tracemalloc,
+	or the approximate growth of the resident set size where tracemalloc is not available.
+	'''
+	def __init__(self, memory = False):
+		self.methods = OrderedDict() # methods['AddSubstitution'] = [calls, seconds, bytes]
+		self.phases = OrderedDict() # phases['feature kern'] = [calls, seconds, bytes]
+		self.wrapped = [] # Names of the wrapped methods
+		self.enabled = True
+		self.memory = None # 'tracemalloc', 'rss' or None
+		if memory:
+			if tracemalloc is not None:
+				self.memory = 'tracemalloc'
+			elif ResidentBytes() is not None:
+				self.memory = 'rss'
+		self.startedtracing = False
+		if self.memory == 'tracemalloc' and not tracemalloc.is_tracing():
+			tracemalloc.start()
+			self.startedtracing = True
+
+	def Stop(self):
+		self.enabled = False
+		if self.startedtracing:
+			tracemalloc.stop()
+			self.startedtracing = False
+
+	def Start(self):
+		return time.time(), self.Bytes()
+
+	def Bytes(self):
+		if self.memory == 'tracemalloc':
+			return tracemalloc.get_traced_memory()[0]
+		elif self.memory == 'rss':
+			return ResidentBytes()
+		return 0
+
+	def Add(self, records, name, calls, start):
+		record = records.get(name)
+		if record is None:
+			record = records[name] = [0, 0.0, 0]
+		record[0] += calls
+		record[1] += time.time() - start[0]
+		if self.memory:
+			record[2] += self.Bytes() - start[1]
+
+	def Wrap(self, name, method):
+		'''
+		Returns method wrapped for profiling. Generators returned by the method are profiled while they are consumed.
+		'''
+		profiler = self
+		def Profiled(*args, **kwargs):
+			start = profiler.Start()
+			try:
+				result = method(*args, **kwargs)
+			finally:
+				profiler.Add(profiler.methods, name, 1, start)
+			if isinstance(result, types.GeneratorType):
+				return profiler.Generator(profiler.methods, name, result)
+			return result
+		Profiled.__name__ = name
+		Profiled.__doc__ = method.__doc__
+		return Profiled
+
+	def Phase(self, name, iterator):
+		'''
+		Returns iterator profiled as one call of phase "name".
+		'''
+		self.Add(self.phases, name, 1, self.Start())
+		return self.Generator(self.phases, name, iterator)
+
+	def Generator(self, records, name, iterator):
+		while True:
+			start = self.Start()
+			try:
+				item = next(iterator)
+			except StopIteration:
+				self.Add(records, name, 0, start)
+				return
+			self.Add(records, name, 0, start)
+			yield item
+
+	def Report(self):
+		methods = OrderedDict()
+		for name in sorted(self.methods.keys(), key = lambda name: -self.methods[name][1]):
+			methods[name] = self.Record(self.methods[name])
+		phases = OrderedDict()
+		for name, record in self.phases.items():
+			phases[name] = self.Record(record)
+		return {'methods': methods, 'phases': phases, 'memory': self.memory}
+
+	def Record(self, record):
+		bytes = None
+		if self.memory:
+			bytes = record[2]
+		return {'calls': record[0], 'seconds': record[1], 'bytes': bytes}
+
+
+
+def ResidentBytes():
+	'''
+	Current resident set size of this process in bytes, or None if unavailable.
+	Read from /proc on Linux, elsewhere the maximum resident set size reported by the resource module is used instead.
+	'''
+	try:
+		f = open('/proc/self/statm')
+		try:
+			return int(f.read().split()[1]) * RESIDENTPAGESIZE
+		finally:
+			f.close()
+	except (IOError, OSError, ValueError, IndexError):
+		pass
+	if resource is None:
+		return None
+	maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == 'darwin':
+		return maxrss # bytes
+	return maxrss * 1024 # kilobytes
+
+if resource is not None:
+	RESIDENTPAGESIZE = resource.getpagesize()
+else:
+	RESIDENTPAGESIZE = 4096
+
+
+
 # Different Lookup types
+# Lookups are stored in large numbers, so they are kept compact with __slots__.
+# The lookup type is a class attribute, and script/language/lookupflag strings are interned.
+
+internedstrings = {}
+
+def Intern(string):
+	'''
+	Return a shared instance of string, so that repeated script/language/lookupflag values are stored only once.
+	'''
+	return internedstrings.setdefault(string, string)
 
 # GSUB
 
-class GSUBLookup:
+class GSUBLookup(object):
+	__slots__ = ('feature', 'script', 'language', 'lookupflag', 'source', 'target', 'comment')
+	type = 'GSUBLookup'
+
 	def __init__(self, feature, source, target, script, language, lookupflag, comment):
-		self.type = 'GSUBLookup'
-		self.lookupflag = lookupflag
-		self.script = script
-		self.language = language
-		self.feature = feature
+		self.lookupflag = Intern(lookupflag)
+		self.script = Intern(script)
+		self.language = Intern(language)
+		self.feature = Intern(feature)
 		self.source = source
 		self.target = target
 		self.comment = comment
 
 
-class FeatureLookup: # AFDKO: feature smcp;
+class FeatureLookup(object): # AFDKO: feature smcp;
+	__slots__ = ('feature', 'script', 'language', 'lookupflag', 'lookupfeature', 'comment')
+	type = 'FeatureLookup'
+
 	def __init__(self, feature, script, language, lookupflag, lookupfeature, comment):
-		self.type = 'FeatureLookup'
-		self.lookupflag = lookupflag
-		self.script = script
-		self.language = language
-		self.feature = feature
+		self.lookupflag = Intern(lookupflag)
+		self.script = Intern(script)
+		self.language = Intern(language)
+		self.feature = Intern(feature)
 		self.lookupfeature = lookupfeature
 		self.comment = comment
 
 # GPOS
 
-class GPOSLookupType1:
+class GPOSLookupType1(object):
+	__slots__ = ('feature', 'script', 'language', 'lookupflag', 'glyphs', 'adjustment', 'comment')
+	type = 'GPOSLookupType1'
+
 	def __init__(self, feature, glyphs, adjustment, script, language, lookupflag, comment):
-		self.type = 'GPOSLookupType1'
-		self.feature = feature
+		self.feature = Intern(feature)
 		self.glyphs = glyphs
 		self.adjustment = adjustment # four touple (n, n, n, n)
-		self.script = script
-		self.language = language
-		self.lookupflag = lookupflag
+		self.script = Intern(script)
+		self.language = Intern(language)
+		self.lookupflag = Intern(lookupflag)
 		self.comment = comment
 
-class GPOSLookupType2:
-	def __init__(self, feature, pair, adjustment, script, language, lookupflag, comment):
-		self.type = 'GPOSLookupType2'
-		self.feature = feature
+class GPOSLookupType2(object):
+	__slots__ = ('feature', 'script', 'language', 'lookupflag', 'pair', 'adjustment', 'comment', 'enum')
+	type = 'GPOSLookupType2'
+
+	def __init__(self, feature, pair, adjustment, script, language, lookupflag, comment, enum = False):
+		self.feature = Intern(feature)
 		self.pair = pair
 		self.adjustment = adjustment # four touple (n, n, n, n)
-		self.script = script
-		self.language = language
-		self.lookupflag = lookupflag
+		self.script = Intern(script)
+		self.language = Intern(language)
+		self.lookupflag = Intern(lookupflag)
+		self.comment = comment
+		self.enum = enum # AFDKO: enum pos, enumerate class pair into specific glyph pairs
+
+
+
+class GPOSPairBlock(object):
+	'''
+	Columnar block of pair positionings for one feature/script/language/lookupflag, as added by AddPairPositioningBatch().
+	Adjustments are either an array.array of x-advances or a list of four-tuples.
+	'''
+	__slots__ = ('feature', 'script', 'language', 'lookupflag', 'lefts', 'rights', 'adjustments', 'comment')
+	type = 'GPOSPairBlock'
+
+	def __init__(self, feature, lefts, rights, adjustments, script, language, lookupflag, comment):
+		self.feature = Intern(feature)
+		self.lefts = lefts
+		self.rights = rights
+		self.adjustments = adjustments
+		self.script = Intern(script)
+		self.language = Intern(language)
+		self.lookupflag = Intern(lookupflag)
 		self.comment = comment
 
+	def __len__(self):
+		return len(self.lefts)
+
+
+def PairBlockValues(adjustments):
+	'''
+	Normalize a sequence of adjustments for a GPOSPairBlock.
+	Returns a compact array.array if all adjustments are plain x-advances, otherwise a list of four-tuples.
+	'''
+	values = []
+	simple = True
+	for adjustment in adjustments:
+		if isinstance(adjustment, (tuple, list)):
+			adjustment = (int(adjustment[0]), int(adjustment[1]), int(adjustment[2]), int(adjustment[3]))
+			if adjustment[1] or adjustment[2] or adjustment[3]:
+				simple = False
+		else:
+			adjustment = (int(adjustment), 0, 0, 0)
+		values.append(adjustment)
+	if simple:
+		return array.array('l', [value[0] for value in values])
+	return values
+
+
+
+def LookupStatement(lookup, pairindex = None):
+	'''
+	Hashable representation of the statement of a lookup, without its comment.
+	For GPOSPairBlocks, "pairindex" selects the pair. Pair positionings compare equal whether they come from blocks or not.
+	'''
+	if isinstance(lookup, GSUBLookup):
+		return ('sub', lookup.source, lookup.target)
+	elif isinstance(lookup, FeatureLookup):
+		return ('feature', lookup.lookupfeature)
+	elif isinstance(lookup, GPOSLookupType1):
+		return ('pos1', lookup.glyphs, tuple(lookup.adjustment))
+	elif isinstance(lookup, GPOSLookupType2):
+		if lookup.enum:
+			return ('enum pos2', lookup.pair, tuple(lookup.adjustment))
+		return ('pos2', lookup.pair, tuple(lookup.adjustment))
+	elif isinstance(lookup, GPOSPairBlock):
+		adjustment = lookup.adjustments[pairindex]
+		if isinstance(lookup.adjustments, array.array):
+			adjustment = (adjustment, 0, 0, 0)
+		return ('pos2', lookup.lefts[pairindex] + ' ' + lookup.rights[pairindex], tuple(adjustment))
+	return (lookup.type, id(lookup))
+
+def SliceGPOSPairBlock(lookup, indices):
+	'''
+	Returns new GPOSPairBlock with the pairs at the given indices.
+	'''
+	if isinstance(lookup.adjustments, array.array):
+		adjustments = array.array(lookup.adjustments.typecode, [lookup.adjustments[i] for i in indices])
+	else:
+		adjustments = [lookup.adjustments[i] for i in indices]
+	return GPOSPairBlock(lookup.feature, [lookup.lefts[i] for i in indices], [lookup.rights[i] for i in indices], adjustments, lookup.script, lookup.language, lookup.lookupflag, lookup.comment)
+
+def IsGlyphPairLookup(lookup):
+	'''
+	True if a pair positioning lookup only consists of pairs of two single glyphs.
+	'''
+	if isinstance(lookup, GPOSPairBlock):
+		return all([IsSingleGlyph(left) for left in lookup.lefts]) and all([IsSingleGlyph(right) for right in lookup.rights])
+	if isinstance(lookup, GPOSLookupType2) and not lookup.enum:
+		glyphs = lookup.pair.split(' ')
+		return len(glyphs) == 2 and IsSingleGlyph(glyphs[0]) and IsSingleGlyph(glyphs[1])
+	return False
+
+def PairLookupPairs(lookup):
+	'''
+	Generator yielding (left, right, adjustment four-tuple) of a glyph pair lookup or GPOSPairBlock.
+	'''
+	if isinstance(lookup, GPOSPairBlock):
+		simple = isinstance(lookup.adjustments, array.array)
+		for left, right, adjustment in zip(lookup.lefts, lookup.rights, lookup.adjustments):
+			if simple:
+				adjustment = (adjustment, 0, 0, 0)
+			yield left, right, tuple(adjustment)
+	else:
+		left, right = lookup.pair.split(' ')
+		yield left, right, tuple(lookup.adjustment)
+
+def ClusterPairs(pairs):
+	'''
+	Cluster the glyphs of a {(left, right): adjustment} dictionary for class kerning.
+	Left glyphs with identical kerning rows form one left class, right glyphs with identical columns (over the left classes) one right class.
+	Returns (left classes, right classes, [(left class index, right class index, adjustment)]), each in order of first appearance.
+	'''
+	rows = OrderedDict()
+	for (left, right), adjustment in pairs.items():
+		rows.setdefault(left, []).append((right, adjustment))
+
+	# Left classes: identical rows
+	leftclasses = []
+	leftclassofsignature = {}
+	leftclassofglyph = {}
+	for left, row in rows.items():
+		signature = tuple(sorted(row))
+		if not signature in leftclassofsignature:
+			leftclassofsignature[signature] = len(leftclasses)
+			leftclasses.append([])
+		leftclasses[leftclassofsignature[signature]].append(left)
+		leftclassofglyph[left] = leftclassofsignature[signature]
+
+	# Right classes: identical columns over left classes
+	columns = OrderedDict()
+	for (left, right), adjustment in pairs.items():
+		column = columns.setdefault(right, {})
+		column[leftclassofglyph[left]] = adjustment
+	rightclasses = []
+	rightclassofsignature = {}
+	rightclassofglyph = {}
+	for right, column in columns.items():
+		signature = tuple(sorted(column.items()))
+		if not signature in rightclassofsignature:
+			rightclassofsignature[signature] = len(rightclasses)
+			rightclasses.append([])
+		rightclasses[rightclassofsignature[signature]].append(right)
+		rightclassofglyph[right] = rightclassofsignature[signature]
+
+	classpairs = []
+	seen = set()
+	for (left, right), adjustment in pairs.items():
+		key = (leftclassofglyph[left], rightclassofglyph[right])
+		if not key in seen:
+			seen.add(key)
+			classpairs.append(key + (adjustment,))
+
+	return leftclasses, rightclasses, classpairs
+
+def EstimatePairPosFormat1Size(firstglyphs, pairs, simple = True):
+	'''
+	Estimated size in bytes of a PairPos format 1 (glyph pairs) subtable.
+	'''
+	if not pairs:
+		return 0
+	valuesize = 2
+	if not simple:
+		valuesize = 8
+	# header, coverage, PairSet offsets and counts, PairValueRecords
+	return 10 + (4 + 2 * firstglyphs) + 4 * firstglyphs + pairs * (2 + valuesize)
+
+def EstimatePairPosFormat2Size(leftglyphs, leftclasses, rightglyphs, rightclasses, simple = True):
+	'''
+	Estimated size in bytes of a PairPos format 2 (class pairs) subtable.
+	'''
+	if not leftclasses or not rightclasses:
+		return 0
+	valuesize = 2
+	if not simple:
+		valuesize = 8
+	# header, coverage, two ClassDefs, Class1Records including class 0
+	return 16 + (4 + 2 * leftglyphs) + (6 + 2 * leftglyphs) + (6 + 2 * rightglyphs) + (leftclasses + 1) * (rightclasses + 1) * valuesize
+
+class PairSubtableEstimate:
+	'''
+	Running size estimate of the PairPos format 2 subtable that the class pair positionings put out so far end up in.
+	Decides where "subtable;" breaks go, so that the offsets of large class kerning don't overflow when compiling.
+	The lookups need to be grouped with GroupClassPairs() first, with its groups handed over as "groups": all glyphs of
+	a left side must be in the same subtable, as only the first subtable covering a glyph is applied to it.
+	So breaks only go before the first pair of a left side, and all pairs of the left side are counted at once.
+	Glyph pairs and enumerated pairs are not counted. Compilers put all glyph pairs of a lookup into one format 1 subtable
+	whatever the "subtable;" breaks, so the breaks can't keep that subtable from overflowing.
+	"classes" is the classes dictionary of the DancingShoes object, to count the glyphs of class references.
+	'''
+	def __init__(self, maximum, classes = None, groups = None):
+		self.maximum = maximum # Maximum estimated subtable size in bytes
+		self.classes = classes
+		self.groups = groups or {} # groups[left side] = (right sides, simple), see GroupClassPairs()
+		self.sideglyphs = {} # Cache of SideGlyphs()
+		self.Reset()
+
+	def Reset(self):
+		self.leftclasses = set()
+		self.leftglyphs = set()
+		self.rightclasses = set()
+		self.rightglyphs = 0
+		self.simple = True
+
+	def __getstate__(self):
+		# Classes, groups and the glyph cache are not shipped to worker processes, see parallel.EmitTask()
+		state = self.__dict__.copy()
+		state['classes'] = None
+		state['groups'] = {}
+		state['sideglyphs'] = {}
+		return state
+
+	def SideGlyphs(self, side):
+		'''
+		Returns list of glyph names of one side of a pair: a glyph, a class reference or a bracketed group.
+		'''
+		glyphs = self.sideglyphs.get(side)
+		if glyphs is None:
+			glyphs = []
+			for token in ClassStringTokens(side):
+				if token.startswith('@'):
+					if self.classes is not None and token in self.classes:
+						glyphs.extend(self.classes[token])
+				elif token:
+					glyphs.append(token)
+			self.sideglyphs[side] = glyphs
+		return glyphs
+
+	def Size(self):
+		return EstimatePairPosFormat2Size(len(self.leftglyphs), len(self.leftclasses), self.rightglyphs, len(self.rightclasses), self.simple)
+
+	def AddGroup(self, left, rights, simple):
+		self.leftclasses.add(left)
+		self.leftglyphs.update(self.SideGlyphs(left))
+		for right in rights:
+			if not right in self.rightclasses:
+				self.rightclasses.add(right)
+				self.rightglyphs += len(self.SideGlyphs(right))
+		self.simple = self.simple and simple
+
+	def Pair(self, left, right, simple = True, enum = False):
+		'''
+		Count a pair positioning, returns True if a subtable break needs to be put out before it:
+		if it is the first class pair of its left side, and the estimate would exceed the maximum with all pairs of that left side added.
+		'''
+		if enum or left in self.leftclasses or not IsClassPair(left, right):
+			return False
+		rights, groupsimple = self.groups.get(left, ((right,), simple))
+		empty = not self.leftclasses
+		self.AddGroup(left, rights, groupsimple)
+		if not empty and self.Size() > self.maximum:
+			self.Reset()
+			self.AddGroup(left, rights, groupsimple)
+			return True
+		return False
+
+	def Lookup(self, lookup, start = None, end = None):
+		'''
+		Count the pairs of a lookup like FDKlookuplines() does when putting it out, without putting it out.
+		"start" and "end" optionally restrict a GPOSPairBlock to a slice of its pairs.
+		'''
+		if isinstance(lookup, GPOSLookupType2):
+			sides = PairSides(lookup.pair)
+			if len(sides) == 2:
+				self.Pair(sides[0], sides[1], IsSimpleAdjustment(lookup.adjustment), lookup.enum)
+		elif isinstance(lookup, GPOSPairBlock):
+			simple = isinstance(lookup.adjustments, array.array)
+			if start is None:
+				start, end = 0, len(lookup)
+			for i in range(start, end):
+				self.Pair(lookup.lefts[i], lookup.rights[i], simple or IsSimpleAdjustment(lookup.adjustments[i]))
+
+	def Copy(self):
+		estimate = PairSubtableEstimate(self.maximum, self.classes, self.groups)
+		estimate.sideglyphs = self.sideglyphs
+		estimate.leftclasses = set(self.leftclasses)
+		estimate.leftglyphs = set(self.leftglyphs)
+		estimate.rightclasses = set(self.rightclasses)
+		estimate.rightglyphs = self.rightglyphs
+		estimate.simple = self.simple
+		return estimate
+
+def GroupClassPairs(lookups):
+	'''
+	Returns (lookups, groups): the lookups with all class pairs of a left side moved up to the first of them, and dictionary of
+	left side -> (list of right sides, True if all adjustments only change the advance width) for PairSubtableEstimate.
+	Class pairs of GPOSPairBlocks are split off into blocks of their own. All other lookups keep their order.
+	Without class pairs, the lookups are returned as they are.
+	'''
+	grouped = {} # grouped[left side] = list of GPOSLookupType2 objects and (block, index) pairs
+	groups = {}
+	entries = [] # lookups, and the lists of grouped for the groups in order of their first pair
+
+	def Add(left, right, simple, item):
+		if not left in grouped:
+			grouped[left] = []
+			entries.append(grouped[left])
+			groups[left] = [[], set(), True]
+		grouped[left].append(item)
+		group = groups[left]
+		if not right in group[1]:
+			group[1].add(right)
+			group[0].append(right)
+		group[2] = group[2] and simple
+
+	for lookup in lookups:
+		if isinstance(lookup, GPOSLookupType2):
+			if not lookup.enum and ('@' in lookup.pair or '[' in lookup.pair):
+				sides = PairSides(lookup.pair)
+				if len(sides) == 2 and IsClassPair(sides[0], sides[1]):
+					Add(sides[0], sides[1], IsSimpleAdjustment(lookup.adjustment), lookup)
+					continue
+		elif isinstance(lookup, GPOSPairBlock):
+			simple = isinstance(lookup.adjustments, array.array)
+			run = [] # indices of glyph pairs since the last class pair
+			split = False
+			for i in range(len(lookup)):
+				if IsClassPair(lookup.lefts[i], lookup.rights[i]):
+					if run:
+						entries.append(PairBlockSlice(lookup, run))
+						run = []
+					Add(lookup.lefts[i], lookup.rights[i], simple or IsSimpleAdjustment(lookup.adjustments[i]), (lookup, i))
+					split = True
+				else:
+					run.append(i)
+			if split:
+				if run:
+					entries.append(PairBlockSlice(lookup, run))
+				continue
+		entries.append(lookup)
+
+	if not groups:
+		return lookups, groups
+
+	result = []
+	for entry in entries:
+		if isinstance(entry, list):
+			block, indices = None, []
+			for item in entry + [None]:
+				if isinstance(item, tuple) and item[0] is block:
+					indices.append(item[1])
+					continue
+				if block is not None:
+					result.append(PairBlockSlice(block, indices))
+					block, indices = None, []
+				if isinstance(item, tuple):
+					block, indices = item[0], [item[1]]
+				elif item is not None:
+					result.append(item)
+		else:
+			result.append(entry)
+	for left, (rights, rightset, simple) in groups.items():
+		groups[left] = (rights, simple)
+	return result, groups
+
+def PairBlockSlice(block, indices):
+	'''
+	Returns new GPOSPairBlock of the pairs of a block at the given indices.
+	'''
+	adjustments = [block.adjustments[i] for i in indices]
+	if isinstance(block.adjustments, array.array):
+		adjustments = array.array(block.adjustments.typecode, adjustments)
+	return GPOSPairBlock(block.feature, [block.lefts[i] for i in indices], [block.rights[i] for i in indices], adjustments, block.script, block.language, block.lookupflag, block.comment)
+
+def IsClassPair(left, right):
+	'''
+	True if a pair positioning goes into a format 2 subtable: either side is a class or a bracketed group, and there are no context marks.
+	'''
+	return (left.startswith('@') or left.startswith('[') or right.startswith('@') or right.startswith('[')) and not "'" in left and not "'" in right
+
+def ClassStringTokens(string, classes = True):
+	'''
+	Split a sequence of glyph names and class references into its tokens, dropping marks and brackets:
+	"[@fractionslashes @dnom_target] @numr_target'" -> ['@fractionslashes', '@dnom_target', '@numr_target']
+	With "classes" switched off, class references are left out.
+	'''
+	tokens = string.replace("'", "").replace("[", "").replace("]", "").split(' ')
+	if not classes:
+		tokens = [token for token in tokens if not token.startswith('@')]
+	return tokens
+
+def PairSides(pair):
+	'''
+	Split the pair of a pair positioning into its two sides, keeping bracketed groups together: '[a b] @C' -> ['[a b]', '@C']
+	'''
+	sides = []
+	depth = 0
+	for token in pair.split(' '):
+		if not token:
+			continue
+		if depth:
+			sides[-1] += ' ' + token
+		else:
+			sides.append(token)
+		depth += token.count('[') - token.count(']')
+	return sides
+
+def IsSimpleAdjustment(adjustment):
+	'''
+	True if an adjustment four-tuple only changes the advance width.
+	'''
+	return adjustment[1] == 0 and adjustment[2] == 0 and adjustment[3] == 0
+
+def IsSingleGlyph(sequence):
+	'''
+	True if a sequence is a single glyph name, without context marks, classes or spaces.
+	'''
+	return sequence and not ' ' in sequence and not "'" in sequence and not '@' in sequence and not '[' in sequence
+
+
+
+# Classes
+
+class GlyphClass:
+	'''
+	Glyph class keeping its glyphs in insertion order for output, with set-backed membership.
+	Glyphs are only added once; further attempts are counted in self.duplicates.
+	'''
+	def __init__(self, glyphnames = ()):
+		self.glyphs = []
+		self.glyphset = set()
+		self.duplicates = 0
+		for glyph in glyphnames:
+			self.Add(glyph)
+
+	def Add(self, glyph):
+		'''
+		Add glyph, returns False if it was already present.
+		'''
+		if glyph in self.glyphset:
+			self.duplicates += 1
+			return False
+		self.glyphs.append(glyph)
+		self.glyphset.add(glyph)
+		return True
+
+	append = Add
+
+	def __contains__(self, glyph):
+		return glyph in self.glyphset
+
+	def __iter__(self):
+		return iter(self.glyphs)
+
+	def __len__(self):
+		return len(self.glyphs)
+
+	def __getitem__(self, index):
+		return self.glyphs[index]
+
+	def __eq__(self, other):
+		if isinstance(other, GlyphClass):
+			return self.glyphs == other.glyphs
+		return self.glyphs == other
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __repr__(self):
+		return 'GlyphClass(%r)' % (self.glyphs)
+
+	def Glyphs(self):
+		return self.glyphs
+
+	def HasGlyphs(self, glyphslist):
+		return self.glyphset.issuperset(glyphslist)
+
+	def Copy(self):
+		glyphclass = GlyphClass()
+		glyphclass.glyphs = list(self.glyphs)
+		glyphclass.glyphset = set(self.glyphset)
+		glyphclass.duplicates = self.duplicates
+		return glyphclass
+
+	def FrozenCopy(self):
+		glyphclass = FrozenGlyphClass()
+		glyphclass.glyphs = list(self.glyphs)
+		glyphclass.glyphset = set(self.glyphset)
+		glyphclass.duplicates = self.duplicates
+		return glyphclass
+
+	def Union(self, other):
+		'''
+		Glyphs of this class followed by the glyphs of the other class not in this one.
+		'''
+		glyphclass = self.Copy()
+		for glyph in other:
+			if not glyph in glyphclass.glyphset:
+				glyphclass.glyphs.append(glyph)
+				glyphclass.glyphset.add(glyph)
+		return glyphclass
+
+	def Intersection(self, other):
+		'''
+		Glyphs of this class that are also in the other class.
+		'''
+		glyphclass = GlyphClass()
+		glyphclass.glyphs = [glyph for glyph in self.glyphs if glyph in other]
+		glyphclass.glyphset = set(glyphclass.glyphs)
+		return glyphclass
+
+	def Difference(self, other):
+		'''
+		Glyphs of this class that are not in the other class.
+		'''
+		glyphclass = GlyphClass()
+		glyphclass.glyphs = [glyph for glyph in self.glyphs if not glyph in other]
+		glyphclass.glyphset = set(glyphclass.glyphs)
+		return glyphclass
+
+
+class FrozenGlyphClass(GlyphClass):
+	'''
+	Read-only glyph class of a FrozenDancingShoes object. Copy() returns a normal GlyphClass again.
+	'''
+	def Add(self, glyph):
+		raise TypeError('Attempting to add glyph "%s" to a class, but the class belongs to a frozen DancingShoes object' % (glyph))
+
+	append = Add
+
+
+class FrozenClasses(dict):
+	'''
+	Read-only classes dictionary of a FrozenDancingShoes object.
+	Missing classes read as empty classes, as with Ddict, but are not added.
+	'''
+	def __getitem__(self, classname):
+		if not classname in self:
+			return FrozenGlyphClass()
+		return dict.__getitem__(self, classname)
+
+	def Frozen(self, *arguments, **keywords):
+		raise TypeError('Attempting to change classes, but this DancingShoes object is frozen')
+
+	__setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = Frozen
+
+	def __reduce__(self):
+		return (FrozenClasses, (dict(self),))
+
+
+
+# Glyph repertoire
+
+class GlyphRepertoire:
+	'''
+	Collection of the glyph names of a font.
+	Membership is checked against a set, while the original order of the glyph names is preserved for output.
+	'''
+	def __init__(self, glyphnames):
+		self.glyphnames = list(glyphnames)
+		self.glyphset = set(self.glyphnames)
+
+	def __contains__(self, glyph):
+		return glyph in self.glyphset
+
+	def __iter__(self):
+		return iter(self.glyphnames)
+
+	def __len__(self):
+		return len(self.glyphnames)
+
+	def Glyphs(self):
+		'''
+		Returns list of glyph names in original order.
+		'''
+		return self.glyphnames
+
+	def HasAllGlyphs(self, glyphslist):
+		'''
+		Return True, if all submitted glyphs are present.
+		'''
+		if isinstance(glyphslist, str):
+			return glyphslist in self.glyphset
+		return self.glyphset.issuperset(glyphslist)
+
+	def MissingGlyphs(self, glyphslist):
+		'''
+		Return list of submitted glyphs that are not present, in submitted order and without duplicates.
+		'''
+		if isinstance(glyphslist, str):
+			glyphslist = [glyphslist]
+		missing = []
+		seen = set()
+		for glyph in glyphslist:
+			if not glyph in self.glyphset and not glyph in seen:
+				seen.add(glyph)
+				missing.append(glyph)
+		return missing
+
 
 
 # Helper functions
 
 def CollectGlyphGroups(glyphnames):
+	return GlyphGroups(glyphnames)
+
+
+class GlyphGroups:
+	'''
+	Index of glyph name suffixes, built in one pass over the glyph names.
+	Every trailing suffix level forms a group: 'a.sc.ss01' is member of the groups '.ss01' and '.sc.ss01'.
+	Supports the dictionary interface of the former groups dictionary: glyphgroups['.sc'], '.sc' in glyphgroups, glyphgroups.keys()
+	'''
+	def __init__(self, glyphnames):
+		self.groups = OrderedDict() # groups['.sc'] = ['a.sc', 'b.sc' ...], in glyph order
+		self.groupsets = {} # groupsets['.sc'] = set(['a.sc', 'b.sc' ...])
+		self.glyphsuffixes = {} # glyphsuffixes['a.sc.ss01'] = ['.ss01', '.sc.ss01']
+		self.basenames = {} # basenames['a.sc.ss01'] = 'a.sc'
+
+		for glyphname in glyphnames:
+			if '.' in glyphname: # has ending, but is no ligature
+				stem, ending = os.path.splitext(glyphname)
+				self.basenames[glyphname] = stem
+				suffixes = [ending]
+				# further suffix levels
+				while ending:
+					stem, level = os.path.splitext(stem)
+					if not level:
+						break
+					ending = level + ending
+					suffixes.append(ending)
+				self.glyphsuffixes[glyphname] = suffixes
+				for suffix in suffixes:
+					if not suffix in self.groups:
+						self.groups[suffix] = []
+						self.groupsets[suffix] = set()
+					if not glyphname in self.groupsets[suffix]:
+						self.groups[suffix].append(glyphname)
+						self.groupsets[suffix].add(glyphname)
+
+	def __contains__(self, suffix):
+		return suffix in self.groups
+
+	def __getitem__(self, suffix):
+		return self.groups[suffix]
+
+	def __iter__(self):
+		return iter(self.groups)
+
+	def __len__(self):
+		return len(self.groups)
+
+	def keys(self):
+		return list(self.groups.keys())
+
+	def has_key(self, suffix):
+		return suffix in self.groups
 
-	list = Ddict(dict)
+	def Groups(self):
+		'''
+		Returns list of all suffixes, in order of first appearance.
+		'''
+		return list(self.groups.keys())
 
-	for glyphname in glyphnames:
-		if '.' in glyphname: # has ending, but is no ligature
-			ending = os.path.splitext(glyphname)[1]
-			if not list.has_key(ending):
-				list[ending] = []
-			list[ending].append(glyphname)
-	
-	return list
+	def GlyphsInGroup(self, suffix):
+		'''
+		Returns list of glyphs with suffix, in glyph order.
+		'''
+		return self.groups.get(suffix, [])
+
+	def GroupHasGlyphs(self, suffix, glyphslist):
+		'''
+		Returns True if all glyphs are present in group
+		'''
+		if not suffix in self.groupsets:
+			return False
+		if isinstance(glyphslist, str):
+			return glyphslist in self.groupsets[suffix]
+		return self.groupsets[suffix].issuperset(glyphslist)
+
+	def GroupsOfGlyph(self, glyph):
+		'''
+		Returns list of all suffixes of a glyph, shortest first.
+		'''
+		return self.glyphsuffixes.get(glyph, [])
+
+	def BaseGlyph(self, glyph):
+		'''
+		Returns glyph name without its last suffix: 'a.sc.ss01' -> 'a.sc'
+		'''
+		stem = self.basenames.get(glyph)
+		if stem is None:
+			return os.path.splitext(glyph)[0]
+		return stem
+
+	def SourceGlyph(self, glyph, suffix):
+		'''
+		Returns glyph name without the given suffix level: ('a.sc.ss01', '.sc.ss01') -> 'a'
+		'''
+		if suffix and glyph.endswith(suffix):
+			return glyph[:-len(suffix)]
+		return self.BaseGlyph(glyph)
 
 # write lines of FDK feature code
 
 def FDKlookupcode(lookups, intendlevel):
-	featurecode = []
+	return list(FDKlookuplines(lookups, intendlevel))
+
+def FDKlookuplines(lookups, intendlevel, estimate = None):
+	'''
+	Generator yielding the code lines of lookups.
+	"estimate" is an optional PairSubtableEstimate; a "subtable;" line is put out wherever it asks for a subtable break.
+	'''
 	intend = '  '
 
 	for lookup in lookups:
 		if isinstance(lookup, GSUBLookup):
 			comment = ''
 			if lookup.comment: comment = '# ' + lookup.comment
-			featurecode.append((intendlevel * intend) + 'sub %s by %s; %s' % (lookup.source, lookup.target, comment))
+			yield (intendlevel * intend) + 'sub %s by %s; %s' % (lookup.source, lookup.target, comment)
 
 		elif isinstance(lookup, FeatureLookup):
 			comment = ''
 			if lookup.comment: comment = '# ' + lookup.comment
-			featurecode.append((intendlevel * intend) + 'feature %s; %s' % (lookup.lookupfeature, comment))
+			yield (intendlevel * intend) + 'feature %s; %s' % (lookup.lookupfeature, comment)
 
 		elif isinstance(lookup, GPOSLookupType1):
 			comment = ''
@@ -791,7 +2580,7 @@ def FDKlookupcode(lookups, intendlevel):
 				adjustmentcode = lookup.adjustment[0]
 			else:
 				adjustmentcode = '<%s %s %s %s>' % (lookup.adjustment[0], lookup.adjustment[1], lookup.adjustment[2], lookup.adjustment[3])
-			featurecode.append((intendlevel * intend) + 'pos %s %s; %s' % (lookup.glyphs, adjustmentcode, comment))
+			yield (intendlevel * intend) + 'pos %s %s; %s' % (lookup.glyphs, adjustmentcode, comment)
 
 		elif isinstance(lookup, GPOSLookupType2):
 			comment = ''
@@ -800,10 +2589,54 @@ def FDKlookupcode(lookups, intendlevel):
 				adjustmentcode = lookup.adjustment[0]
 			else:
 				adjustmentcode = '<%s %s %s %s>' % (lookup.adjustment[0], lookup.adjustment[1], lookup.adjustment[2], lookup.adjustment[3])
-			featurecode.append((intendlevel * intend) + 'pos %s %s; %s' % (lookup.pair, adjustmentcode, comment))
-	
-	return featurecode
+			if estimate is not None:
+				sides = PairSides(lookup.pair)
+				if len(sides) == 2 and estimate.Pair(sides[0], sides[1], IsSimpleAdjustment(lookup.adjustment), lookup.enum):
+					yield (intendlevel * intend) + 'subtable;'
+			if lookup.enum:
+				yield (intendlevel * intend) + 'enum pos %s %s; %s' % (lookup.pair, adjustmentcode, comment)
+			else:
+				yield (intendlevel * intend) + 'pos %s %s; %s' % (lookup.pair, adjustmentcode, comment)
+
+		elif isinstance(lookup, GPOSPairBlock):
+			comment = ''
+			if lookup.comment: comment = '# ' + lookup.comment
+			simple = isinstance(lookup.adjustments, array.array)
+			for left, right, adjustment in zip(lookup.lefts, lookup.rights, lookup.adjustments):
+				if estimate is not None and estimate.Pair(left, right, simple or IsSimpleAdjustment(adjustment)):
+					yield (intendlevel * intend) + 'subtable;'
+				if simple:
+					adjustmentcode = adjustment
+				elif adjustment[1] == 0 and adjustment[2] == 0 and adjustment[3] == 0:
+					adjustmentcode = adjustment[0]
+				else:
+					adjustmentcode = '<%s %s %s %s>' % (adjustment[0], adjustment[1], adjustment[2], adjustment[3])
+				yield (intendlevel * intend) + 'pos %s %s %s; %s' % (left, right, adjustmentcode, comment)
+
+def JoinLines(lines):
+	'''
+	Generator yielding lines separated by line breaks, the streaming equivalent of '\\n'.join(lines).
+	'''
+	first = True
+	for line in lines:
+		if first:
+			first = False
+			yield line
+		else:
+			yield '\n' + line
+
 
+# The opentypenames tables, imported by OpenTypeNames() on first use
+opentypenamesmodule = None
+
+def OpenTypeNames():
+	'''
+	Returns the opentypenames module with the descriptive names of OpenType tags, importing it on first use.
+	'''
+	global opentypenamesmodule
+	if opentypenamesmodule is None:
+		from dancingshoes import opentypenames as opentypenamesmodule
+	return opentypenamesmodule
 
 def TranslateLanguage(language, defaultlanguage):
 	return language.replace('__DEFAULT__', defaultlanguage)
@@ -823,13 +2656,70 @@ class Ddict(dict):
         return dict.__getitem__(self, key)
 
 
+# FDK code versions
+
+class FDKCodeVersion:
+	'''
+	Properties of the feature code syntax of one AFDKO version.
+	'''
+	def __init__(self, name, defaultscript, defaultlanguage, lookupflagjoiner, inlinedefaultlookups):
+		self.name = name # Version string, such as '2.5'
+		self.defaultscript = defaultscript # Tag of the default script
+		self.defaultlanguage = defaultlanguage # Tag of the default language
+		self.lookupflagjoiner = lookupflagjoiner # Separator of several lookupflags in one lookupflag statement
+		self.inlinedefaultlookups = inlinedefaultlookups # Put out default script/language lookups without script/language statements, even if other scripts follow
+
+# Registry of code versions, fdkcodeversions['2.5'] = FDKCodeVersion(...)
+fdkcodeversions = OrderedDict()
+
+def RegisterFDKCodeVersion(codeversion):
+	'''
+	Add an FDKCodeVersion to the available code versions, or replace the one of the same name.
+	'''
+	fdkcodeversions[codeversion.name] = codeversion
+
+RegisterFDKCodeVersion(FDKCodeVersion('2.3', 'dflt', 'dflt', ', ', False))
+RegisterFDKCodeVersion(FDKCodeVersion('2.5', 'DFLT', 'dflt', ' ', True))
+
+def FDKCodeVersionSettings(codeversion):
+	'''
+	Returns the registered FDKCodeVersion of a version string.
+	'''
+	if not codeversion in fdkcodeversions:
+		raise ValueError('Unknown FDK code version "%s", available are: %s' % (codeversion, ', '.join(fdkcodeversions.keys())))
+	return fdkcodeversions[codeversion]
+
+# Code version used when none is given, see DefaultFDKCodeVersion()
+defaultfdkcodeversion = None
+
+def SetFDKCodeVersion(codeversion):
+	'''
+	Set the code version used when none is given. None detects it again on next use.
+	'''
+	global defaultfdkcodeversion
+	defaultfdkcodeversion = codeversion
+
+def DefaultFDKCodeVersion():
+	'''
+	Returns the code version used when none is given: the one set with SetFDKCodeVersion(), else the one in the
+	environment variable DANCINGSHOES_FDKCODEVERSION, else 2.3 within FontLab and 2.5 outside.
+	Detected once and remembered afterwards.
+	'''
+	global defaultfdkcodeversion
+	if defaultfdkcodeversion is None:
+		codeversion = os.environ.get('DANCINGSHOES_FDKCODEVERSION')
+		if not codeversion:
+			try:
+				import FL
+				codeversion = "2.3"
+			except ImportError:
+				codeversion = "2.5"
+		defaultfdkcodeversion = codeversion
+	return defaultfdkcodeversion
+
 def GetFDKCodeVersion(codeversion):
 	if not codeversion:
-		try:
-			import FL
-			codeversion = "2.3"
-		except:
-			codeversion = "2.5"
+		codeversion = DefaultFDKCodeVersion()
 	
 	return codeversion
 
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+
+"""
+Batch builder
+
+Applies one rule set to many fonts, such as all masters and instances of a family.
+Rules are recorded once on a DancingShoesBatch object with the same methods as on DancingShoes.
+They are normalized and tokenized at that time, so for each font only the glyph repertoire filtering
+and the code emission remain to be done. Sequence strings are shared between all generated fonts.
+
+Usage:
+	batch = DancingShoesBatch(features)
+	batch.AddSimpleSubstitutionFeature('smcp', '.sc')
+	batch.AddSubstitutions(SubstitutionsFromCSV('substitutions.csv'))
+	batch.AddPairPositioning('kern', 'T A', -30)
+	code = batch.Run([('Regular', glyphnames1), ('Bold', glyphnames2)])
+	print batch.TimingReport()
+"""
+
+import time
+from collections import OrderedDict
+
+from dancingshoes import DancingShoes, GSUBLookup, GPOSLookupType1, GPOSLookupType2, Intern, ClassStringTokens
+
+
+class DancingShoesBatch:
+	def __init__(self, features):
+		self.features = features # List four-digit feature name codes, in order preferred by the foundry/designer
+		self.rules = [] # Normalized rules, in order of recording
+		self.strings = {} # Shared string table for sequences
+		self.tokens = {} # tokens[sequence] = tuple of plain glyph names of the sequence, class references excluded
+		self.timings = [] # List of (fontname, build seconds, emission seconds) of the last Run()
+
+	def SharedString(self, string):
+		return self.strings.setdefault(string, string)
+
+	def GlyphTokens(self, sequence):
+		'''
+		Tokenize a sequence like DancingShoes.DeflateClassString() once for all fonts.
+		Class references are left out: classes only ever contain glyphs present in a font.
+		'''
+		tokens = self.tokens.get(sequence)
+		if tokens is None:
+			tokens = tuple(ClassStringTokens(sequence, classes = False))
+			self.tokens[sequence] = tokens
+		return tokens
+
+
+	## Recording rules, same signatures as on DancingShoes
+
+	def AddFeatureLookup(self, feature, lookupfeature, script = '', language = '', lookupflag = '', comment = ''):
+		self.rules.append(('AddFeatureLookup', (feature, lookupfeature, script, language, lookupflag, comment)))
+
+	def AddSimpleSubstitutionFeature(self, feature, ending):
+		self.rules.append(('AddSimpleSubstitutionFeature', (feature, ending)))
+
+	def AddSubstitution(self, feature, source, target, script = '', language = '', lookupflag = '', comment = ''):
+		source = self.SharedString(source)
+		target = self.SharedString(target)
+		self.rules.append(('AddSubstitution', (Intern(feature), source, target, Intern(script or '__DEFAULT__'), Intern(language or '__DEFAULT__'), Intern(lookupflag or '__DEFAULT__'), comment, self.GlyphTokens(source) + self.GlyphTokens(target))))
+
+	def AddSubstitutions(self, rows):
+		'''
+		Record substitutions from an iterable of rows, see DancingShoes.AddSubstitutions().
+		When applied to a font, the diagnostics of DancingShoes.AddSubstitutions() are used.
+		'''
+		substitutions = []
+		for row in rows:
+			feature, source, target, script, language, lookupflag, comment = (tuple(row) + ('', '', '', '', ''))[:7]
+			source = self.SharedString(source)
+			target = self.SharedString(target)
+			substitutions.append((Intern(feature), source, target, Intern(script or '__DEFAULT__'), Intern(language or '__DEFAULT__'), Intern(lookupflag or '__DEFAULT__'), comment, self.GlyphTokens(source) + self.GlyphTokens(target)))
+		self.rules.append(('AddSubstitutions', substitutions))
+
+	def AddSinglePositioning(self, feature, glyph, adjustment, script = '', language = '', lookupflag = '', comment = ''):
+		if isinstance(adjustment, int) or isinstance(adjustment, str):
+			adjustment = (int(adjustment), 0, 0, 0)
+		glyph = self.SharedString(glyph)
+		self.rules.append(('AddSinglePositioning', (Intern(feature), glyph, adjustment, Intern(script or '__DEFAULT__'), Intern(language or '__DEFAULT__'), Intern(lookupflag or '__DEFAULT__'), comment, self.GlyphTokens(glyph))))
+
+	def AddPairPositioning(self, feature, pair, adjustment, script = '', language = '', lookupflag = '', comment = ''):
+		if isinstance(adjustment, int) or isinstance(adjustment, str):
+			adjustment = (int(adjustment), 0, 0, 0)
+		pair = self.SharedString(pair)
+		self.rules.append(('AddPairPositioning', (Intern(feature), pair, adjustment, Intern(script or '__DEFAULT__'), Intern(language or '__DEFAULT__'), Intern(lookupflag or '__DEFAULT__'), comment, self.GlyphTokens(pair))))
+
+	def AddPairPositioningBatch(self, feature, lefts, rights, adjustments, script = '', language = '', lookupflag = '', comment = ''):
+		if hasattr(lefts, 'tolist'):
+			lefts = lefts.tolist()
+		if hasattr(rights, 'tolist'):
+			rights = rights.tolist()
+		lefts = [self.SharedString(left) for left in lefts]
+		rights = [self.SharedString(right) for right in rights]
+		self.rules.append(('AddPairPositioningBatch', (feature, lefts, rights, adjustments, script, language, lookupflag, comment)))
+
+	def AddGlyphsToClass(self, classname, glyphnames):
+		if isinstance(glyphnames, list):
+			glyphnames = tuple(glyphnames)
+		self.rules.append(('AddGlyphsToClass', (classname, glyphnames)))
+
+	def DuplicateFeature(self, source, target):
+		self.rules.append(('DuplicateFeature', (source, target)))
+
+
+	## Building fonts
+
+	def Build(self, glyphnames, features = None):
+		'''
+		Returns a new DancingShoes object for the glyph names, with all recorded rules applied.
+		"features" overrides the batch's feature list for this font.
+		'''
+		if features is None:
+			features = self.features
+		shoes = DancingShoes(glyphnames, features)
+		repertoire = shoes.repertoire
+		present = {} # Presence of token tuples in this font
+
+		for method, arguments in self.rules:
+
+			if method == 'AddSubstitution':
+				feature, source, target, script, language, lookupflag, comment, tokens = arguments
+				if not feature in shoes.features:
+					shoes.Diagnose('unknown-feature', feature, kind = 'substitution')
+				if not tokens in present:
+					present[tokens] = repertoire.HasAllGlyphs(tokens)
+				if present[tokens]:
+					shoes.RegisterLookup(GSUBLookup(feature, source, target, script, language, lookupflag, comment))
+				else:
+					shoes.Diagnose('missing-substitution-glyphs', feature, lambda source = source, target = target: shoes.MissingGlyphs(shoes.DeflateClassString(source) + shoes.DeflateClassString(target)), source = source, target = target)
+
+			elif method == 'AddSubstitutions':
+				knownfeatures = {}
+				rejected = 0
+				rejectedfeatures = {}
+				for feature, source, target, script, language, lookupflag, comment, tokens in arguments:
+					if not feature in knownfeatures:
+						knownfeatures[feature] = feature in shoes.features
+						if not knownfeatures[feature]:
+							shoes.Diagnose('unknown-feature', feature, kind = 'substitutions')
+					if not tokens in present:
+						present[tokens] = repertoire.HasAllGlyphs(tokens)
+					if present[tokens]:
+						shoes.RegisterLookup(GSUBLookup(feature, source, target, script, language, lookupflag, comment))
+					else:
+						rejected += 1
+						rejectedfeatures[feature] = rejectedfeatures.get(feature, 0) + 1
+				if rejected:
+					shoes.Diagnose('rejected-substitutions', rejected = rejected, rejectedfeatures = rejectedfeatures)
+
+			elif method == 'AddSinglePositioning' or method == 'AddPairPositioning':
+				feature, glyphs, adjustment, script, language, lookupflag, comment, tokens = arguments
+				if not feature in shoes.features:
+					shoes.Diagnose('unknown-feature', feature, kind = {'AddSinglePositioning': 'single positioning lookup', 'AddPairPositioning': 'pair positioning lookup'}[method])
+				if not tokens in present:
+					present[tokens] = repertoire.HasAllGlyphs(tokens)
+				if present[tokens]:
+					if method == 'AddSinglePositioning':
+						shoes.RegisterLookup(GPOSLookupType1(feature, glyphs, adjustment, script, language, lookupflag, comment))
+					else:
+						shoes.RegisterLookup(GPOSLookupType2(feature, glyphs, adjustment, script, language, lookupflag, comment))
+
+			else:
+				getattr(shoes, method)(*arguments)
+
+		return shoes
+
+	def Run(self, fonts, codeversion = None):
+		'''
+		Build and generate feature code for several fonts.
+		"fonts" is a list of (fontname, glyphnames) or (fontname, glyphnames, features) tuples.
+		Returns an ordered dictionary of fontname -> feature code. Timings are kept in self.timings.
+		'''
+		results = OrderedDict()
+		self.timings = []
+		for font in fonts:
+			fontname, glyphnames = font[0], font[1]
+			features = None
+			if len(font) > 2:
+				features = font[2]
+			start = time.time()
+			shoes = self.Build(glyphnames, features)
+			built = time.time()
+			results[fontname] = shoes.GetFDKCode(codeversion)
+			self.timings.append((fontname, built - start, time.time() - built))
+		return results
+
+	def TimingReport(self):
+		'''
+		Returns per-font and total timings of the last Run() as a string.
+		'''
+		lines = ['TIMINGS:']
+		totalbuild = 0
+		totalemission = 0
+		for fontname, build, emission in self.timings:
+			lines.append('%s: build %.3fs, emission %.3fs, total %.3fs' % (fontname, build, emission, build + emission))
+			totalbuild += build
+			totalemission += emission
+		lines.append('%s font(s): build %.3fs, emission %.3fs, total %.3fs' % (len(self.timings), totalbuild, totalemission, totalbuild + totalemission))
+		return '\n'.join(lines)
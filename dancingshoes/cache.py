@@ -0,0 +1,140 @@
+#!/usr/bin/python
+
+"""
+Feature code cache
+
+Opt-in on-disk cache of generated feature code. The cache key is a hash of everything the code
+depends on: glyph repertoire, feature order, lookups, classes, output settings, code version and library version.
+Lookups and classes are hashed while the font is built (see DancingShoes.LookupsDigest()), so a cache hit
+doesn't have to go through them again.
+Unchanged fonts are served from disk without generating their code again.
+The cache directory is kept below a size limit by removing the least recently used entries.
+
+Usage:
+	cache = FeatureCodeCache('/path/to/cache')
+	code = cache.GetFDKCode(shoes)
+"""
+
+import os, hashlib, tempfile
+
+import dancingshoes
+from dancingshoes import GetFDKCodeVersion, Digest
+
+
+class FeatureCodeCache:
+	def __init__(self, directory, maxbytes = 256 * 1024 * 1024):
+		self.directory = directory # Cache directory, created if missing
+		self.maxbytes = maxbytes # Size limit of all cached files together
+		self.hits = 0
+		self.misses = 0
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	def Path(self, key):
+		return os.path.join(self.directory, key + '.fea')
+
+	def GetFDKCode(self, shoes, codeversion = None):
+		'''
+		Return shoes.GetFDKCode(codeversion), served from the cache if the inputs are unchanged.
+		'''
+		codeversion = GetFDKCodeVersion(codeversion)
+		path = self.Path(FeatureCodeKey(shoes, codeversion))
+
+		if os.path.exists(path):
+			try:
+				f = open(path, 'r')
+				try:
+					code = f.read()
+				finally:
+					f.close()
+				os.utime(path, None) # mark as recently used
+				self.hits += 1
+				return code
+			except (IOError, OSError):
+				pass # evicted by another process meanwhile
+
+		self.misses += 1
+		code = shoes.GetFDKCode(codeversion)
+		self.Store(path, code)
+		self.Evict()
+		return code
+
+	def Store(self, path, code):
+		'''
+		Write code to path atomically, so concurrent builds never read half-written files.
+		'''
+		handle, temppath = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+		f = os.fdopen(handle, 'w')
+		try:
+			f.write(code)
+		finally:
+			f.close()
+		try:
+			os.rename(temppath, path)
+		except OSError:
+			# On Windows, rename doesn't replace existing files. Another build stored the same key then, which means the same code
+			os.remove(temppath)
+			if not os.path.exists(path):
+				raise
+
+	def Entries(self):
+		'''
+		Returns list of (modification time, size, path) of all cached files, least recently used first.
+		'''
+		entries = []
+		for filename in os.listdir(self.directory):
+			if filename.endswith('.fea'):
+				path = os.path.join(self.directory, filename)
+				try:
+					stat = os.stat(path)
+				except OSError:
+					continue
+				entries.append((stat.st_mtime, stat.st_size, path))
+		entries.sort()
+		return entries
+
+	def Size(self):
+		return sum([size for mtime, size, path in self.Entries()])
+
+	def Evict(self):
+		'''
+		Remove least recently used files until the cache fits into self.maxbytes.
+		'''
+		entries = self.Entries()
+		total = sum([size for mtime, size, path in entries])
+		for mtime, size, path in entries:
+			if total <= self.maxbytes:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			total -= size
+
+	def Clear(self):
+		for mtime, size, path in self.Entries():
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+
+
+def FeatureCodeKey(shoes, codeversion):
+	'''
+	Returns hexadecimal hash of all inputs that the feature code of a DancingShoes object depends on.
+	Lookups and classes enter through the digests that the DancingShoes object keeps up to date while it is built,
+	so computing the key doesn't go through all lookups again.
+	'''
+	hash = hashlib.sha1()
+
+	def Update(value):
+		hash.update(repr(value).encode('utf-8'))
+		hash.update(b'\0')
+
+	Update(('Dancing Shoes', dancingshoes.__version__, codeversion, shoes.subtablesize, shoes.namecomments))
+	Update(Digest('\n'.join(shoes.Glyphs())))
+	Update(tuple(shoes.features))
+	Update(shoes.LookupsDigest())
+	Update(shoes.ClassesDigest())
+
+	return hash.hexdigest()
@@ -1,21 +1,61 @@
 #!/usr/bin/python
 
-import re, os
+import re, os, sys, csv
 # input files
 
 # read simple substitutions from a comma-delimited, quote-embraced CSV file
-def SubstitutionsFromCSV(path):
-	list = []
-	csv = open(path, 'r')
-	for line in csv:
-		lineparts = re.findall('(".+?")?,?', line)
-		lineparts = map(unquote, lineparts)
-		lineparts = lineparts[0:7]
-		if lineparts[0] and lineparts[1] and lineparts[2]: # first three fields (feature, source and target) are required
-			list.append(lineparts)
-	csv.close()
-
-	return list
+def SubstitutionsFromCSV(path, features = None, scripts = None):
+	'''
+	Generator yielding [feature, source, target, script, language, lookupflag, comment] rows from a CSV file.
+	Files ending in .gz are read gzip-compressed. Fields starting with "#" are treated as comments.
+	"features" and "scripts" optionally restrict the rows to these feature and script tags.
+	Rows without a script tag count as script "__DEFAULT__".
+	'''
+	if features is not None:
+		features = set(features)
+	if scripts is not None:
+		scripts = set(scripts)
+
+	csvfile = OpenCSV(path)
+	try:
+		for lineparts in csv.reader(csvfile):
+
+			# first three fields (feature, source and target) are required
+			if len(lineparts) < 3 or not lineparts[0] or not lineparts[1] or not lineparts[2]:
+				continue
+			if lineparts[0].startswith('#') or lineparts[1].startswith('#') or lineparts[2].startswith('#'): # cancel out comments
+				continue
+
+			# filter rows before building them
+			if features is not None and not lineparts[0] in features:
+				continue
+			if scripts is not None:
+				script = ''
+				if len(lineparts) > 3 and not lineparts[3].startswith('#'):
+					script = lineparts[3]
+				if not (script or '__DEFAULT__') in scripts:
+					continue
+
+			lineparts = [uncomment(part) for part in lineparts[0:7]]
+			while len(lineparts) < 7:
+				lineparts.append('')
+			yield lineparts
+	finally:
+		csvfile.close()
+
+
+def OpenCSV(path):
+	'''
+	Open a CSV file for csv.reader(), reading gzip-compressed files transparently.
+	'''
+	if path.endswith('.gz'):
+		import gzip
+		if sys.version_info[0] >= 3:
+			return gzip.open(path, 'rt', newline = '')
+		return gzip.open(path, 'rb')
+	if sys.version_info[0] >= 3:
+		return open(path, 'r', newline = '')
+	return open(path, 'rb')
 
 
 
@@ -76,6 +116,47 @@ def AssignFeatureCodeToGlyphsFont(f, shoes):
 		f.classes.append(newClass)
 
 
+def UpdateFeatureCodeInGlyphsFont(f, shoes):
+	'''
+	Like AssignFeatureCodeToGlyphsFont(), but only touches the features and classes that changed since the last call.
+	'''
+
+	from GlyphsApp import NewClass, NewFeature
+
+	for feature, code in shoes.ChangedFeatureContents().items():
+		existing = None
+		for i in range(len(f.features)):
+			if f.features[i].name == feature:
+				existing = i
+				break
+		if code is None:
+			if existing is not None:
+				del(f.features[existing])
+		elif existing is not None:
+			f.features[existing].code = code
+		else:
+			Feature = NewFeature()
+			Feature.name = feature
+			Feature.automatic = False # The Feature will not be removed on the next autogenerate run.
+			Feature.code = code
+			f.features.append(Feature)
+
+	for otclass, code in shoes.ChangedClasses().items():
+		existing = None
+		for i in range(len(f.classes)):
+			if f.classes[i].name == otclass:
+				existing = i
+				break
+		if existing is not None:
+			f.classes[existing].code = code
+		else:
+			newClass = NewClass(otclass)
+			newClass.name = otclass
+			newClass.code = code
+			newClass.automatic = False # The Class will not be removed on the next autogenerate run.
+			f.classes.append(newClass)
+
+
 def AssignFeatureCodeToRoboFabFont(f, shoes):
 	f.features.text = shoes.GetFDKCode()
 	
@@ -88,3 +169,7 @@ def unquote(string):
 			return ''
 	else: return ''
 
+def uncomment(string):
+	if string.startswith('#'): # cancel out comments
+		return ''
+	return string
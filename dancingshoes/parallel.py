@@ -0,0 +1,284 @@
+#!/usr/bin/python
+
+"""
+Parallel building
+
+Builds feature code for many fonts in a pool of worker processes.
+Each job is a (glyphnames, features, rules) tuple. "rules" is either a DancingShoesBatch
+or a module-level function that is called with a fresh DancingShoes object and adds the rules to it.
+Every distinct rule source is shipped to each worker only once, when the worker starts
+(inherited on fork, pickled once on spawn). Results come back in job order and are identical
+to building the jobs one after the other.
+
+GetFDKCodeParallel() generates the feature code of a single font in parallel instead:
+the font is frozen into a snapshot that is shipped to each worker once, feature blocks are put out
+concurrently, and large features such as kern are split into chunks of lookups.
+
+Uses concurrent.futures if available with worker initializers (Python 3.7 and later), multiprocessing otherwise.
+
+Usage:
+	results = BuildFeatureCodeParallel([(glyphnames1, features, batch), (glyphnames2, features, batch)])
+	code = GetFDKCodeParallel(shoes)
+"""
+
+from dancingshoes import DancingShoes, FrozenDancingShoes, GPOSPairBlock, GetFDKCodeVersion, FDKlookuplines
+
+
+# Rule sources of the current worker process, set by InitWorker()
+workerrules = []
+
+# Frozen DancingShoes object of the current worker process, set by InitEmitWorker()
+workersnapshot = None
+
+
+def BuildFeatureCodeParallel(jobs, workers = None, codeversion = None, outputpaths = None):
+	'''
+	Build feature code for a list of (glyphnames, features, rules) jobs in worker processes.
+	"workers" is the number of processes, defaulting to the number of CPUs. With workers = 1 all jobs run in this process.
+	"outputpaths" is an optional list of file paths, one per job. If given, the feature code is written there and the path is returned instead of the code.
+	Returns list of feature code strings (or paths), in job order.
+	'''
+
+	# Resolve code version here, as worker processes can't see the host application
+	codeversion = GetFDKCodeVersion(codeversion)
+
+	# Ship each distinct rule source only once
+	rulesources = []
+	rulesindex = {}
+	tasks = []
+	for i, (glyphnames, features, rules) in enumerate(jobs):
+		if not id(rules) in rulesindex:
+			rulesindex[id(rules)] = len(rulesources)
+			rulesources.append(rules)
+		outputpath = None
+		if outputpaths:
+			outputpath = outputpaths[i]
+		tasks.append((glyphnames, features, rulesindex[id(rules)], codeversion, outputpath))
+
+	return MapInProcesses(BuildJob, tasks, workers, InitWorker, (rulesources,))
+
+
+def GetFDKCodeParallel(shoes, codeversion = None, workers = None, chunksize = 20000):
+	'''
+	Return feature code all in one string, like shoes.GetFDKCode(), but put out the features in worker processes.
+	Features with more than "chunksize" lookup lines are split into chunks that are put out separately.
+	The result is identical to shoes.GetFDKCode().
+	'''
+
+	codeversion = GetFDKCodeVersion(codeversion)
+	if isinstance(shoes, FrozenDancingShoes):
+		snapshot = shoes
+	else:
+		snapshot = shoes.Freeze()
+
+	tasks = []
+	features = [] # (feature, task number or None, content lines with Chunk placeholders or None)
+	for feature in snapshot.UsedFeatures():
+		if FeatureWeight(snapshot, feature) <= chunksize:
+			features.append((feature, len(tasks), None))
+			tasks.append(('feature', feature, codeversion))
+		else:
+			planner = ChunkPlanner(snapshot, tasks, chunksize)
+			features.append((feature, None, list(snapshot.IterFDKFeatureContentLines(feature, codeversion, planner.LookupLines))))
+
+	results = MapInProcesses(EmitTask, tasks, workers, InitEmitWorker, (snapshot,))
+
+	featurecode = [''.join(snapshot.IterFDKLanguageSystemCode(codeversion)), ''.join(snapshot.IterFDKClassesCode(codeversion))]
+	for feature, tasknumber, lines in features:
+		if tasknumber is not None:
+			featurecode.append(results[tasknumber])
+		else:
+			content = []
+			for line in lines:
+				if isinstance(line, Chunk):
+					content.append(results[line.tasknumber])
+				else:
+					content.append(line)
+			featurecode.append('feature %s {\n%s\n\n} %s;\n' % (feature, '\n'.join(content), feature))
+	return '\n'.join(featurecode)
+
+
+def MapInProcesses(function, tasks, workers = None, initializer = None, initargs = ()):
+	'''
+	Returns [function(task) for task in tasks], computed in a pool of worker processes.
+	"function" and "initializer" must be module-level functions. initializer(*initargs) runs once per worker.
+	'''
+	if workers is None:
+		workers = CPUCount()
+	workers = min(workers, len(tasks))
+
+	if workers <= 1:
+		if initializer:
+			initializer(*initargs)
+		return [function(task) for task in tasks]
+
+	executor = None
+	try:
+		from concurrent.futures import ProcessPoolExecutor
+		executor = ProcessPoolExecutor(workers, initializer = initializer, initargs = initargs)
+	except (ImportError, TypeError):
+		# No concurrent.futures, or the Python 2 backport whose executor doesn't take initializers
+		pass
+
+	if executor is not None:
+		try:
+			return list(executor.map(function, tasks))
+		finally:
+			executor.shutdown()
+
+	import multiprocessing
+	pool = multiprocessing.Pool(workers, initializer, initargs)
+	try:
+		return pool.map(function, tasks)
+	finally:
+		pool.close()
+		pool.join()
+
+
+def InitWorker(rulesources):
+	global workerrules
+	workerrules = rulesources
+
+
+def BuildJob(task):
+	'''
+	Build and generate feature code of one job in the current process.
+	'''
+	glyphnames, features, rulesindex, codeversion, outputpath = task
+	shoes = BuildShoes(glyphnames, features, workerrules[rulesindex])
+
+	if outputpath:
+		f = open(outputpath, 'w')
+		try:
+			shoes.WriteFDKCode(f, codeversion)
+		finally:
+			f.close()
+		return outputpath
+
+	return shoes.GetFDKCode(codeversion)
+
+
+def InitEmitWorker(snapshot):
+	global workersnapshot, workergroupedlookups
+	workersnapshot = snapshot
+	workergroupedlookups = {} # workergroupedlookups[(feature, script, language, lookupflag)] = DancingShoes.SubtableLookups() of the lookups
+
+
+def EmitTask(task):
+	'''
+	Put out a whole feature, or a chunk of lookups of one feature/script/language/lookupflag, in the current process.
+	'''
+	if task[0] == 'feature':
+		feature, codeversion = task[1:]
+		return workersnapshot.GetFDKFeatureCode(feature, codeversion)
+
+	feature, script, language, lookupflag, intendlevel, segments, estimate = task[1:]
+	lookups = workersnapshot.lookupindex[feature][script][language][lookupflag]
+	if estimate is not None:
+		# Same grouping of class pairs as in ChunkPlanner, done once per worker
+		key = (feature, script, language, lookupflag)
+		if not key in workergroupedlookups:
+			workergroupedlookups[key] = workersnapshot.SubtableLookups(lookups)
+		lookups, groupedestimate = workergroupedlookups[key]
+		estimate.classes = workersnapshot.classes
+		estimate.groups = groupedestimate.groups
+	chunk = []
+	for position, start, end in segments:
+		lookup = lookups[position]
+		if start is not None:
+			lookup = GPOSPairBlock(lookup.feature, lookup.lefts[start:end], lookup.rights[start:end], lookup.adjustments[start:end], lookup.script, lookup.language, lookup.lookupflag, lookup.comment)
+		chunk.append(lookup)
+	return '\n'.join(FDKlookuplines(chunk, intendlevel, estimate))
+
+
+class Chunk:
+	'''
+	Placeholder for the code lines of a chunk task within the content lines of a feature.
+	'''
+	def __init__(self, tasknumber):
+		self.tasknumber = tasknumber
+
+
+class ChunkPlanner:
+	'''
+	Stands in for DancingShoes.FDKLookupLines(): instead of putting out lookups, it appends chunk tasks
+	of at most "chunksize" lookup lines to "tasks" and yields a Chunk placeholder for each.
+	Each chunk task carries the subtable size estimate at its start, so subtable breaks end up where they would without chunks.
+	'''
+	def __init__(self, snapshot, tasks, chunksize):
+		self.snapshot = snapshot
+		self.tasks = tasks
+		self.chunksize = chunksize
+		self.estimate = None
+		self.lookups = None # Lookups of the feature/script/language/lookupflag being planned, see DancingShoes.SubtableLookups()
+
+	def LookupLines(self, feature, script, language, lookupflag, intendlevel):
+		lookups, self.estimate = self.snapshot.SubtableLookups(self.snapshot.lookupindex.get(feature, {}).get(script, {}).get(language, {}).get(lookupflag, []))
+		self.lookups = lookups
+		segments = []
+		weight = 0
+		for position, lookup in enumerate(lookups):
+			if isinstance(lookup, GPOSPairBlock):
+				start = 0
+				while start < len(lookup):
+					end = min(len(lookup), start + self.chunksize - weight)
+					segments.append((position, start, end))
+					weight += end - start
+					start = end
+					if weight >= self.chunksize:
+						yield self.Task(feature, script, language, lookupflag, intendlevel, segments)
+						segments = []
+						weight = 0
+			else:
+				segments.append((position, None, None))
+				weight += 1
+				if weight >= self.chunksize:
+					yield self.Task(feature, script, language, lookupflag, intendlevel, segments)
+					segments = []
+					weight = 0
+		if segments:
+			yield self.Task(feature, script, language, lookupflag, intendlevel, segments)
+
+	def Task(self, feature, script, language, lookupflag, intendlevel, segments):
+		estimate = None
+		if self.estimate is not None:
+			estimate = self.estimate.Copy()
+			for position, start, end in segments:
+				self.estimate.Lookup(self.lookups[position], start, end)
+		self.tasks.append(('chunk', feature, script, language, lookupflag, intendlevel, segments, estimate))
+		return Chunk(len(self.tasks) - 1)
+
+
+def FeatureWeight(shoes, feature):
+	'''
+	Number of lookup lines of a feature, counting each pair of a GPOSPairBlock.
+	'''
+	weight = 0
+	for script in shoes.lookupindex.get(feature, {}).values():
+		for language in script.values():
+			for lookups in language.values():
+				for lookup in lookups:
+					if isinstance(lookup, GPOSPairBlock):
+						weight += len(lookup)
+					else:
+						weight += 1
+	return weight
+
+
+def BuildShoes(glyphnames, features, rules):
+	'''
+	Returns DancingShoes object for the glyph names with rules applied.
+	'''
+	if hasattr(rules, 'Build'):
+		return rules.Build(glyphnames, features)
+	shoes = DancingShoes(glyphnames, features)
+	rules(shoes)
+	return shoes
+
+
+def CPUCount():
+	try:
+		import multiprocessing
+		return multiprocessing.cpu_count()
+	except (ImportError, NotImplementedError):
+		return 1
@@ -0,0 +1,300 @@
+#!/usr/bin/python
+
+"""
+Precompiled substitution database
+
+Converts substitution rows (as read by helpers.SubstitutionsFromCSV) into a compact binary file
+that is memory-mapped on loading, so fonts can be built without parsing text.
+
+Usage:
+	CompileSubstitutionDatabase(['substitutions.csv'], 'substitutions.dsdb')
+	db = SubstitutionDatabase('substitutions.dsdb')
+	shoes.AddSubstitutions(db.Rows(shoes))
+
+FILE LAYOUT (all integers are little-endian unsigned 32 bit)
+	header        magic 'DSDB', version, and count/offset pairs of the following sections
+	string table  stringcount + 1 offsets into the UTF-8 string data, followed by the data
+	rows          7 string ids (feature, source, target, script, language, lookupflag, comment),
+	              first glyph reference and glyph count per row
+	row glyphs    glyph name string ids of the source and target sequences, class references excluded
+	feature index (feature string id, first row reference, row count), sorted by string id
+	glyph index   (glyph string id, first row reference, row count), sorted by string id
+	row refs      row numbers referenced by the feature and glyph indices, ascending per entry
+"""
+
+import struct, mmap, sys
+
+from dancingshoes import ClassStringTokens
+from dancingshoes.helpers import SubstitutionsFromCSV
+
+try:
+	basestring
+except NameError:
+	basestring = str # Python 3
+
+MAGIC = b'DSDB'
+VERSION = 1
+HEADER = struct.Struct('<4sI14I')
+ROW = struct.Struct('<9I')
+INDEXENTRY = struct.Struct('<3I')
+UINT = struct.Struct('<I')
+
+
+def CompileSubstitutionDatabase(sources, path, features = None, scripts = None):
+	'''
+	Compile substitution sources into a binary database at path.
+	"sources" is a list of CSV file paths (optionally .gz) and/or iterables of substitution rows.
+	"features" and "scripts" are handed to SubstitutionsFromCSV() to skip unwanted rows.
+	Rows need at least feature, source and target; missing script, language, lookupflag and comment are left empty.
+	Returns the number of compiled rows.
+	'''
+
+	strings = []
+	stringids = {}
+
+	def StringID(string):
+		if not string in stringids:
+			stringids[string] = len(strings)
+			strings.append(string)
+		return stringids[string]
+
+	rows = []
+	rowglyphs = []
+	featurerows = {}
+	glyphrows = {}
+
+	for source in sources:
+		if isinstance(source, basestring):
+			source = SubstitutionsFromCSV(source, features, scripts)
+		for row in source:
+			if len(row) < 3:
+				raise ValueError('Substitution row %r has %s field(s), expected at least feature, source and target' % (tuple(row), len(row)))
+			row = (tuple(row) + ('',) * 7)[:7]
+			rownumber = len(rows)
+			ids = [StringID(field) for field in row]
+			glyphstart = len(rowglyphs)
+			seen = set()
+			for glyph in ClassStringTokens(row[1], classes = False) + ClassStringTokens(row[2], classes = False):
+				glyphid = StringID(glyph)
+				rowglyphs.append(glyphid)
+				if not glyphid in seen:
+					seen.add(glyphid)
+					glyphrows.setdefault(glyphid, []).append(rownumber)
+			featurerows.setdefault(ids[0], []).append(rownumber)
+			rows.append(ids + [glyphstart, len(rowglyphs) - glyphstart])
+
+	# Assemble sections
+	encoded = [EncodeString(string) for string in strings]
+	stringoffsets = [0]
+	for data in encoded:
+		stringoffsets.append(stringoffsets[-1] + len(data))
+
+	rowrefs = []
+	featureindex = []
+	for stringid in sorted(featurerows.keys()):
+		featureindex.append((stringid, len(rowrefs), len(featurerows[stringid])))
+		rowrefs.extend(featurerows[stringid])
+	glyphindex = []
+	for stringid in sorted(glyphrows.keys()):
+		glyphindex.append((stringid, len(rowrefs), len(glyphrows[stringid])))
+		rowrefs.extend(glyphrows[stringid])
+
+	sections = [
+		PackUInts(stringoffsets) + b''.join(encoded),
+		b''.join([ROW.pack(*row) for row in rows]),
+		PackUInts(rowglyphs),
+		b''.join([INDEXENTRY.pack(*entry) for entry in featureindex]),
+		b''.join([INDEXENTRY.pack(*entry) for entry in glyphindex]),
+		PackUInts(rowrefs),
+		]
+	counts = [len(strings), len(rows), len(rowglyphs), len(featureindex), len(glyphindex), len(rowrefs)]
+
+	offsets = []
+	offset = HEADER.size
+	for section in sections:
+		offsets.append(offset)
+		offset += len(section)
+
+	header = [MAGIC, VERSION]
+	for count, offset in zip(counts, offsets):
+		header.extend([count, offset])
+	header.extend([0, 0]) # reserved
+
+	f = open(path, 'wb')
+	try:
+		f.write(HEADER.pack(*header))
+		for section in sections:
+			f.write(section)
+	finally:
+		f.close()
+
+	return len(rows)
+
+
+class SubstitutionDatabase:
+	'''
+	Memory-mapped, read-only view of a database written by CompileSubstitutionDatabase().
+	Iterating over it yields all rows as 7-tuples, so it can be handed to DancingShoes.AddSubstitutions() directly.
+	'''
+	def __init__(self, path):
+		self.path = path
+		self.file = open(path, 'rb')
+		self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+
+		header = HEADER.unpack_from(self.data, 0)
+		if header[0] != MAGIC:
+			self.close()
+			raise ValueError('%s is not a Dancing Shoes substitution database' % (path))
+		if header[1] != VERSION:
+			self.close()
+			raise ValueError('%s has database version %s, expected %s' % (path, header[1], VERSION))
+
+		(self.stringcount, self.stringsoffset,
+		self.rowcount, self.rowsoffset,
+		self.rowglyphcount, self.rowglyphsoffset,
+		self.featurecount, self.featureindexoffset,
+		self.glyphcount, self.glyphindexoffset,
+		self.rowrefcount, self.rowrefsoffset) = header[2:14]
+
+		self.stringdataoffset = self.stringsoffset + (self.stringcount + 1) * UINT.size
+		self.featureids = None # Lazily built dict of feature name -> feature index entry
+		self.glyphids = None # Lazily built dict of glyph name -> glyph index entry
+
+	def close(self):
+		if self.data is not None:
+			self.data.close()
+			self.data = None
+		self.file.close()
+
+	def __len__(self):
+		return self.rowcount
+
+	def __iter__(self):
+		for rownumber in range(self.rowcount):
+			yield self.Row(rownumber)
+
+	def String(self, stringid):
+		start, end = struct.unpack_from('<2I', self.data, self.stringsoffset + stringid * UINT.size)
+		return DecodeString(self.data[self.stringdataoffset + start:self.stringdataoffset + end])
+
+	def Row(self, rownumber):
+		'''
+		Returns row as (feature, source, target, script, language, lookupflag, comment) tuple.
+		'''
+		record = ROW.unpack_from(self.data, self.rowsoffset + rownumber * ROW.size)
+		return tuple([self.String(stringid) for stringid in record[:7]])
+
+	def RowGlyphs(self, rownumber):
+		'''
+		Returns list of glyph names used in the source and target sequence of a row, class references excluded.
+		'''
+		record = ROW.unpack_from(self.data, self.rowsoffset + rownumber * ROW.size)
+		return [self.String(UINT.unpack_from(self.data, self.rowglyphsoffset + (record[7] + i) * UINT.size)[0]) for i in range(record[8])]
+
+	def Features(self):
+		'''
+		Returns list of all feature tags in the database.
+		'''
+		return list(self.FeatureIDs().keys())
+
+	def FeatureIDs(self):
+		if self.featureids is None:
+			self.featureids = {}
+			for i in range(self.featurecount):
+				entry = INDEXENTRY.unpack_from(self.data, self.featureindexoffset + i * INDEXENTRY.size)
+				self.featureids[self.String(entry[0])] = entry
+		return self.featureids
+
+	def RowRefs(self, entry):
+		return struct.unpack_from('<%sI' % (entry[2]), self.data, self.rowrefsoffset + entry[1] * UINT.size)
+
+	def RowsForFeature(self, feature):
+		'''
+		Returns ascending row numbers of all rows of a feature.
+		'''
+		entry = self.FeatureIDs().get(feature)
+		if entry is None:
+			return ()
+		return self.RowRefs(entry)
+
+	def GlyphIDs(self):
+		if self.glyphids is None:
+			self.glyphids = {}
+			for i in range(self.glyphcount):
+				entry = INDEXENTRY.unpack_from(self.data, self.glyphindexoffset + i * INDEXENTRY.size)
+				self.glyphids[self.String(entry[0])] = entry
+		return self.glyphids
+
+	def RowsWithGlyph(self, glyph):
+		'''
+		Returns ascending row numbers of all rows using a glyph in their source or target sequence.
+		'''
+		entry = self.GlyphIDs().get(glyph)
+		if entry is None:
+			return ()
+		return self.RowRefs(entry)
+
+	def MissingGlyphRows(self, repertoire):
+		'''
+		Returns set of row numbers that use at least one glyph not contained in repertoire.
+		Each distinct glyph name of the database is checked once.
+		'''
+		missing = set()
+		for glyph, entry in self.GlyphIDs().items():
+			if not glyph in repertoire:
+				missing.update(self.RowRefs(entry))
+		return missing
+
+	def Rows(self, repertoire = None, features = None):
+		'''
+		Generator yielding rows as 7-tuples, in compiled order.
+		"repertoire" can be a DancingShoes object, a GlyphRepertoire or any container of glyph names;
+		if given, only rows whose source and target glyphs are all present are yielded.
+		"features" optionally restricts the rows to these feature tags.
+		'''
+		if repertoire is not None and hasattr(repertoire, 'repertoire'):
+			repertoire = repertoire.repertoire
+
+		if features is not None:
+			rownumbers = set()
+			for feature in features:
+				rownumbers.update(self.RowsForFeature(feature))
+			rownumbers = sorted(rownumbers)
+		else:
+			rownumbers = range(self.rowcount)
+
+		missing = ()
+		if repertoire is not None:
+			missing = self.MissingGlyphRows(repertoire)
+
+		for rownumber in rownumbers:
+			if not rownumber in missing:
+				yield self.Row(rownumber)
+
+
+def SubstitutionsFromDatabase(path, repertoire = None, features = None):
+	'''
+	Generator yielding substitution rows from a compiled database, like helpers.SubstitutionsFromCSV() does for CSV files.
+	'''
+	db = SubstitutionDatabase(path)
+	try:
+		for row in db.Rows(repertoire, features):
+			yield row
+	finally:
+		db.close()
+
+
+# Helper functions
+
+def PackUInts(values):
+	return struct.pack('<%sI' % (len(values)), *values)
+
+def EncodeString(string):
+	if isinstance(string, bytes):
+		return string
+	return string.encode('utf-8')
+
+def DecodeString(data):
+	if sys.version_info[0] >= 3:
+		return data.decode('utf-8')
+	return data